@@ -0,0 +1,716 @@
+"""Load-generation and micro-benchmarks of the mock server.
+
+    python benchmark.py micro
+    python benchmark.py load example-config/specification.yaml \\
+        example-config/events.yaml --clients 200 --rate 2000
+    python benchmark.py parity example-config/specification.yaml \\
+        example-config/events.yaml
+
+The commands can store their results as JSON (--output) and compare them
+with stored results (--baseline), failing when a measurement gets worse
+by more than --tolerance.
+"""
+import argparse
+import base64
+import difflib
+import json
+import logging
+import os
+import shlex
+import struct
+import subprocess
+import sys
+import time
+import timeit
+from typing import Any, Dict, List, Optional, Tuple
+
+import gevent
+from gevent import socket
+
+from compiler import compile_channels, compile_message, message_specs
+from configuration import load_yaml
+from engine import Engines
+from events import EventTypes
+from message import dereference, validate_message
+from wire import Frame, compile_codecs
+
+log = logging.getLogger(__name__)
+
+OPCODE_TEXT = 0x01
+OPCODE_BINARY = 0x02
+OPCODE_CLOSE = 0x08
+
+
+class BenchmarkClient:
+    """Minimal WebSocket client running on gevent - sends text and binary
+    frames (without fragmentation), receives the payloads of unfragmented
+    frames."""
+
+    def __init__(self, host: str, port: int, path: str):
+        self.path = path
+        self.received = 0
+        # time of the first frame received after a fan-out trigger
+        self.first_received_at: Optional[float] = None
+        self._socket = socket.create_connection((host, port))
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._socket.makefile("rb")
+
+        key = base64.b64encode(os.urandom(16)).decode()
+        self._socket.sendall(
+            f"GET {path} HTTP/1.1\r\n"
+            f"Host: {host}:{port}\r\n"
+            f"Upgrade: websocket\r\n"
+            f"Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\n"
+            f"Sec-WebSocket-Version: 13\r\n\r\n".encode())
+
+        status = self._file.readline()
+        if b" 101 " not in status:
+            raise ConnectionError(f"WebSocket upgrade of {path} failed: "
+                                  f"{status!r}")
+        while self._file.readline() not in (b"\r\n", b""):
+            pass
+
+    def send(self, message: Frame) -> None:
+        # str is sent as a text frame, bytes as a binary frame
+        opcode = OPCODE_TEXT if isinstance(message, str) else OPCODE_BINARY
+        payload = message.encode() if isinstance(message, str) \
+            else bytes(message)
+        length = len(payload)
+        if length < 126:
+            header = struct.pack("!BB", 0x80 | opcode, 0x80 | length)
+        elif length <= 0xffff:
+            header = struct.pack("!BBH", 0x80 | opcode, 0x80 | 126, length)
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, 0x80 | 127, length)
+        mask = os.urandom(4)
+        masked = (int.from_bytes(payload, "big") ^ int.from_bytes(
+            (mask * (length // 4 + 1))[:length], "big")
+                  ).to_bytes(length, "big")
+        self._socket.sendall(header + mask + masked)
+
+    def receive(self) -> Optional[bytes]:
+        header = self._file.read(2)
+        if len(header) < 2:
+            return None
+        opcode = header[0] & 0x0f
+        length = header[1] & 0x7f
+        if length == 126:
+            length = struct.unpack("!H", self._file.read(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", self._file.read(8))[0]
+        payload = self._file.read(length)
+        if opcode == OPCODE_CLOSE:
+            return None
+        return payload
+
+    def receive_forever(self) -> None:
+        while True:
+            try:
+                payload = self.receive()
+            except OSError:
+                return
+            if payload is None:
+                return
+            self.received += 1
+            if self.first_received_at is None:
+                self.first_received_at = time.perf_counter()
+
+    def close(self) -> None:
+        try:
+            self._socket.close()
+        except OSError:
+            pass
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    if len(samples) == 0:
+        return {}
+    samples = sorted(samples)
+    out = {f"p{p}": samples[min(len(samples) - 1, len(samples) * p // 100)]
+           for p in (50, 90, 99)}
+    out["max"] = samples[-1]
+    return out
+
+
+def fetch_metrics(port: int) -> str:
+    """:return: metrics served by the mock server (with --metrics)"""
+    connection = socket.create_connection(("127.0.0.1", port))
+    response = b""
+    try:
+        connection.sendall(b"GET /metrics HTTP/1.1\r\nHost: 127.0.0.1\r\n"
+                           b"Connection: close\r\n\r\n")
+        while True:
+            chunk = connection.recv(65536)
+            if not chunk:
+                break
+            response += chunk
+    finally:
+        connection.close()
+    return response.partition(b"\r\n\r\n")[2].decode()
+
+
+def histogram_buckets(metrics: str, name: str) -> Dict[float, float]:
+    """:return: cumulative counts of the buckets of a histogram by their
+    upper bound, summed over all label values"""
+    buckets = {}
+    for line in metrics.splitlines():
+        if not line.startswith(f"{name}_bucket"):
+            continue
+        labels, _, count = line.rpartition(" ")
+        bound = float(labels.split('le="')[1].split('"')[0])
+        buckets[bound] = buckets.get(bound, 0) + float(count)
+    return buckets
+
+
+def histogram_percentiles(before: Dict[float, float],
+                          after: Dict[float, float]) -> Dict[str, float]:
+    """:return: percentiles of the observations between two scrapes
+    of a histogram, interpolated within their buckets"""
+    bounds = sorted(after.keys())
+    counts = [after[bound] - before.get(bound, 0) for bound in bounds]
+    if len(counts) == 0 or counts[-1] == 0:
+        return {}
+    out = {}
+    for p in (50, 90, 99):
+        rank = counts[-1] * p / 100
+        lower, below = 0.0, 0
+        for bound, count in zip(bounds, counts):
+            if count >= rank:
+                # observations beyond the last bucket are reported at it
+                out[f"p{p}"] = lower if bound == float("inf") else \
+                    lower + (bound - lower) * (rank - below) \
+                    / max(count - below, 1)
+                break
+            lower, below = bound, count
+    return out
+
+
+def rss_bytes(pid: int) -> int:
+    with open(f"/proc/{pid}/status", "r") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def cpu_seconds(pid: int) -> float:
+    with open(f"/proc/{pid}/stat", "r") as stat:
+        fields = stat.read().rsplit(")", 1)[1].split()
+    # utime and stime (fields 14 and 15 of proc(5))
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+# Micro-benchmarks:
+
+def synthetic_specification(variants: int) -> Dict:
+    """Specification of a single channel publishing a oneOf
+    of `variants` object messages, each referencing shared schemas."""
+    messages = {}
+    for i in range(variants):
+        messages[f"message_{i}"] = {
+            "name": f"Message{i}",
+            "payload": {
+                "type": "object",
+                "properties": {
+                    "action": {"type": "string", "enum": [f"action_{i}"]},
+                    "user": {"$ref": "#/components/schemas/user"},
+                    f"value_{i % 5}": {"type": "integer",
+                                       "minimum": 0, "maximum": 1000},
+                }
+            },
+            "examples": {"valid": {"value": {
+                "action": f"action_{i}",
+                "user": {"name": "Jane", "age": 30},
+                f"value_{i % 5}": 500,
+            }}}
+        }
+
+    return {
+        "channels": {"synthetic": {"publish": {"message": {"oneOf": [
+            {"$ref": f"#/components/messages/message_{i}"}
+            for i in range(variants)]}}}},
+        "components": {
+            "messages": messages,
+            "schemas": {"user": {
+                "type": "object",
+                "properties": {"name": {"type": "string"},
+                               "age": {"type": "integer", "minimum": 0}}
+            }},
+        },
+    }
+
+
+def time_per_call(function, repeat: int = 5) -> float:
+    """:return: best time of a single call in seconds"""
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def run_micro(sizes: List[int]) -> Dict[str, float]:
+    results = {}
+    for variants in sizes:
+        specification = synthetic_specification(variants)
+        message_specification = specification["channels"]["synthetic"][
+            "publish"]["message"]
+        compiled = compile_message(message_specification, specification)
+        last = specification["components"]["messages"][
+            f"message_{variants - 1}"]["examples"]["valid"]["value"]
+        invalid = dict(last, user={"name": "Jane", "age": -1})
+        reference = f"#/components/messages/message_{variants - 1}/payload"
+
+        assert compiled(last) == validate_message(
+            last, message_specification, specification)
+
+        results[f"dereference[{variants}]"] = time_per_call(
+            lambda: dereference(reference, specification))
+        results[f"validate_message[{variants}]"] = time_per_call(
+            lambda: validate_message(last, message_specification,
+                                     specification))
+        results[f"validate_message_invalid[{variants}]"] = time_per_call(
+            lambda: validate_message(invalid, message_specification,
+                                     specification))
+        results[f"compiled[{variants}]"] = time_per_call(
+            lambda: compiled(last))
+        results[f"compiled_invalid[{variants}]"] = time_per_call(
+            lambda: compiled(invalid))
+        results[f"compile_message[{variants}]"] = time_per_call(
+            lambda: compile_message(message_specification, specification),
+            repeat=3)
+    return results
+
+
+# Load benchmark:
+
+def publish_frames(specification: Dict
+                   ) -> Dict[str, List[Tuple[Frame, bool]]]:
+    """:return: {channel: [(frame, is_valid)]} - examples of the publish
+    messages of each channel and an invalid frame"""
+    frames = {}
+    validators = compile_channels(specification)
+    codecs = compile_codecs(specification)
+    for channel_name, channel in specification["channels"].items():
+        if "publish" not in validators[channel_name]:
+            continue
+        channel_frames = []
+        for message_spec in message_specs(channel["publish"]["message"],
+                                          specification):
+            for example in message_spec.get("examples", {}).values():
+                valid = len(validators[channel_name]["publish"](
+                    example["value"])) > 0
+                codec = codecs[channel_name]["publish"].encoder(
+                    [message_spec["name"]])
+                channel_frames.append((codec.encode(example["value"]), valid))
+        channel_frames.append((codecs[channel_name]["publish"].codecs[0]
+                               .encode({"benchmark": "invalid"}), False))
+        frames[channel_name] = channel_frames
+    return frames
+
+
+def fanout_trigger(specification: Dict, events: Dict
+                   ) -> Optional[Tuple[str, Frame, str]]:
+    """:return: (publish channel, frame, broadcast channel) of a message
+    starting an event which broadcasts before any wait"""
+    codecs = compile_codecs(specification)
+    examples = {}
+    for message in specification.get("components", {}).get(
+            "messages", {}).values():
+        for example in message.get("examples", {}).values():
+            examples.setdefault(message.get("name"), example["value"])
+
+    for event in events["events"].values():
+        if event["when"] != EventTypes.MESSAGE_RECEIVED \
+                or event.get("message_name") not in examples:
+            continue
+        for command in event["do"]:
+            command_name = next(iter(command.keys()))
+            if command_name == "broadcast_example":
+                channel = event["channel"].strip("/")
+                codec = codecs[channel]["publish"].encoder(
+                    [event["message_name"]])
+                return channel, codec.encode(examples[event["message_name"]]), \
+                    command[command_name]["channel"].strip("/")
+            if command_name == "wait":
+                break
+    return None
+
+
+def start_server(args: argparse.Namespace) -> Tuple[int, Any]:
+    """:return: pid of the process running the server and a handle
+    to stop it"""
+    if args.in_process:
+        from mock_server import create_argument_parser, create_server
+        from configuration import load_configuration
+
+        server_args = create_argument_parser().parse_args(
+            [args.specification_file, args.events_file,
+             "-p", str(args.port), "--metrics"]
+            + shlex.split(args.server_args))
+        server = create_server(("127.0.0.1", args.port),
+                               load_configuration(args.specification_file,
+                                                  args.events_file,
+                                                  server_args.cache_dir),
+                               server_args)
+        server.start()
+        return os.getpid(), server
+
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(__file__),
+                                      "mock_server.py"),
+         args.specification_file, args.events_file, "-p", str(args.port),
+         # validation latency is read from the metrics of the server
+         "--metrics"]
+        + shlex.split(args.server_args),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", args.port)).close()
+            return process.pid, process
+        except OSError:
+            gevent.sleep(0.1)
+    process.kill()
+    raise TimeoutError("Mock server did not start in 30 seconds")
+
+
+def stop_server(handle) -> None:
+    if isinstance(handle, subprocess.Popen):
+        handle.terminate()
+        handle.wait()
+    else:
+        handle.stop()
+
+
+def run_load(args: argparse.Namespace) -> Dict[str, float]:
+    with open(args.specification_file, "rb") as specification_file:
+        specification = load_yaml(specification_file.read())
+    with open(args.events_file, "rb") as events_file:
+        events = load_yaml(events_file.read())
+
+    frames = publish_frames(specification)
+    channels = list(frames.keys())
+    if len(channels) == 0:
+        raise ValueError("The specification has no channel with publish "
+                         "messages")
+
+    pid, handle = start_server(args)
+    results = {}
+    clients: List[BenchmarkClient] = []
+    try:
+        gevent.sleep(0.5)
+        rss_before = rss_bytes(pid)
+        for i in range(args.clients):
+            clients.append(BenchmarkClient("127.0.0.1", args.port,
+                                           "/" + channels[i % len(channels)]))
+        receivers = [gevent.spawn(client.receive_forever)
+                     for client in clients]
+        gevent.sleep(0.5)
+        results["memory_per_connection_bytes"] = \
+            (rss_bytes(pid) - rss_before) / args.clients
+        log.info(f"Connected {args.clients} clients")
+
+        # ingest
+        ingest_frames = [(client, frame, valid)
+                         for client in clients
+                         for frame, valid in frames[client.path.strip("/")]
+                         if valid or args.invalid]
+        validations_before = histogram_buckets(fetch_metrics(args.port),
+                                               "mock_validation_seconds")
+        cpu_before = cpu_seconds(pid)
+        sent = 0
+        start = time.perf_counter()
+        interval = 1.0 / args.rate
+        while True:
+            now = time.perf_counter()
+            if now - start >= args.duration:
+                break
+            due = int((now - start) / interval) + 1
+            while sent < due:
+                client, frame, _ = ingest_frames[sent % len(ingest_frames)]
+                client.send(frame)
+                sent += 1
+            gevent.sleep(max(0.0, start + sent * interval
+                             - time.perf_counter()))
+        elapsed = time.perf_counter() - start
+        gevent.sleep(1)
+        results["ingest_messages_per_second"] = sent / elapsed
+        results["server_cpu_per_message_us"] = \
+            (cpu_seconds(pid) - cpu_before) / sent * 1e6
+        log.info(f"Sent {sent} messages in {elapsed:.2f} s")
+
+        # validation latency measured by the server during the ingest
+        latencies = histogram_percentiles(
+            validations_before,
+            histogram_buckets(fetch_metrics(args.port),
+                              "mock_validation_seconds"))
+        if len(latencies) == 0:
+            log.warning("The server has not validated any message "
+                        "(see --validation-mode)")
+        results.update({f"validation_latency_{name}_us": value * 1e6
+                        for name, value in latencies.items()})
+
+        # broadcast fan-out latency
+        trigger = fanout_trigger(specification, events)
+        if trigger is None:
+            log.warning("No event broadcasting right after a received "
+                        "message - skipping the fan-out benchmark")
+        else:
+            publish_channel, frame, broadcast_channel = trigger
+            senders = [client for client in clients
+                       if client.path.strip("/") == publish_channel]
+            recipients = [client for client in clients
+                          if client.path.strip("/") == broadcast_channel]
+            fanouts = []
+            for i in range(args.fanouts):
+                gevent.sleep(args.fanout_interval)
+                for client in recipients:
+                    client.first_received_at = None
+                begin = time.perf_counter()
+                senders[i % len(senders)].send(frame)
+                deadline = begin + 10
+                while time.perf_counter() < deadline and any(
+                        client.first_received_at is None
+                        for client in recipients):
+                    gevent.sleep(0.001)
+                received = [client.first_received_at for client in recipients
+                            if client.first_received_at is not None]
+                if len(received) > 0:
+                    fanouts.append((max(received) - begin) * 1000)
+            results["fanout_recipients"] = len(recipients)
+            results.update({f"fanout_latency_{name}_ms": value
+                            for name, value in percentiles(fanouts).items()})
+
+        gevent.killall(receivers, block=False)
+    finally:
+        for client in clients:
+            client.close()
+        stop_server(handle)
+    return results
+
+
+def run_engines(args: argparse.Namespace) -> Dict[str, float]:
+    """Runs the load benchmark with the server on each of the engines.
+    :return: results of all engines, named "<result>[<engine>]"
+    """
+    results = {}
+    server_args = args.server_args
+    for engine in args.engines:
+        log.info(f"Benchmarking engine {engine}")
+        args.server_args = f"{server_args} --engine {engine}"
+        results.update({f"{name}[{engine}]": value
+                        for name, value in run_load(args).items()})
+    args.server_args = server_args
+    return results
+
+
+# Engine parity check:
+
+def record_transcript(args: argparse.Namespace,
+                      frames: Dict[str, List[Tuple[Frame, bool]]]
+                      ) -> List[str]:
+    """Publishes every frame from the first of two clients of its channel.
+    :return: lines of the frames received by the clients after each
+    published frame
+    """
+    pid, handle = start_server(args)
+    clients: List[BenchmarkClient] = []
+    received: Dict[BenchmarkClient, List[bytes]] = {}
+    transcript = []
+
+    def record(client: BenchmarkClient) -> None:
+        while True:
+            try:
+                payload = client.receive()
+            except OSError:
+                return
+            if payload is None:
+                return
+            received[client].append(payload)
+
+    try:
+        gevent.sleep(0.5)
+        for channel in frames.keys():
+            for _ in range(2):
+                clients.append(BenchmarkClient("127.0.0.1", args.port,
+                                               "/" + channel))
+                received[clients[-1]] = []
+        receivers = [gevent.spawn(record, client) for client in clients]
+
+        for channel, channel_frames in frames.items():
+            channel_clients = [client for client in clients
+                               if client.path == "/" + channel]
+            for frame, _ in channel_frames:
+                channel_clients[0].send(frame)
+                gevent.sleep(args.settle)
+                transcript.append(f"/{channel} <- {frame!r}")
+                for i, client in enumerate(clients):
+                    transcript.extend(f"  {client.path}[{i}] -> {payload!r}"
+                                      for payload in received[client])
+                    received[client] = []
+
+        gevent.killall(receivers, block=False)
+    finally:
+        for client in clients:
+            client.close()
+        stop_server(handle)
+    return transcript
+
+
+def run_parity(args: argparse.Namespace) -> Dict[str, float]:
+    """Runs the events of the example messages on each engine and compares
+    the frames received by the clients.
+    :return: number of received frames of each engine, "differences"
+    when they do not match
+    """
+    with open(args.specification_file, "rb") as specification_file:
+        frames = publish_frames(load_yaml(specification_file.read()))
+
+    transcripts = {}
+    server_args = args.server_args
+    for engine in args.engines:
+        log.info(f"Recording engine {engine}")
+        args.server_args = f"{server_args} --engine {engine}"
+        transcripts[engine] = record_transcript(args, frames)
+    args.server_args = server_args
+
+    results = {f"received_frames[{engine}]": sum(
+        1 for line in transcript if line.startswith("  "))
+        for engine, transcript in transcripts.items()}
+    first, *others = args.engines
+    differences = 0
+    for engine in others:
+        for line in difflib.unified_diff(transcripts[first],
+                                         transcripts[engine], first, engine,
+                                         lineterm=""):
+            print(line)
+            differences += 1
+    if differences > 0:
+        results["differences"] = differences
+    return results
+
+
+def compare(results: Dict[str, float], baseline: Dict[str, float],
+            tolerance: float) -> List[str]:
+    """:return: descriptions of measurements worse than the baseline
+    (all measurements are lower-is-better except throughput)"""
+    regressions = []
+    for name, value in results.items():
+        if name not in baseline or baseline[name] <= 0:
+            continue
+        higher_is_better = name.endswith("per_second")
+        ratio = baseline[name] / value if higher_is_better and value > 0 \
+            else value / baseline[name]
+        if ratio > 1 + tolerance:
+            regressions.append(f"{name}: {value:.6g} "
+                               f"(baseline {baseline[name]:.6g})")
+    return regressions
+
+
+def print_results(results: Dict[str, float]) -> None:
+    width = max(len(name) for name in results)
+    for name, value in results.items():
+        if name.startswith(("dereference", "validate", "compile")):
+            print(f"{name:<{width}}  {value * 1e6:12.3f} us")
+        else:
+            print(f"{name:<{width}}  {value:12.3f}")
+
+
+if __name__ == '__main__':
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--output', action="store", dest="output", type=str,
+                        help="store the results as JSON")
+    common.add_argument('--baseline', action="store", dest="baseline",
+                        type=str, help="compare with stored JSON results")
+    common.add_argument('--tolerance', action="store", dest="tolerance",
+                        type=float, default=0.5)
+    common.add_argument('--debug', action="store_true", default=False)
+
+    parser = argparse.ArgumentParser(description='Mock server benchmarks')
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    micro = subparsers.add_parser('micro', parents=[common])
+    micro.add_argument('--sizes', action="store", dest="sizes", type=int,
+                       nargs="+", default=[1, 10, 100, 1000])
+
+    load_parser = subparsers.add_parser('load', parents=[common])
+    load_parser.add_argument('specification_file', action="store", type=str)
+    load_parser.add_argument('events_file', action="store", type=str)
+    load_parser.add_argument('-p', '--port', action="store", dest="port",
+                             type=int, default=18080)
+    load_parser.add_argument('--clients', action="store", dest="clients",
+                             type=int, default=100)
+    load_parser.add_argument('--rate', action="store", dest="rate",
+                             type=float, default=1000,
+                             help="published messages per second")
+    load_parser.add_argument('--duration', action="store", dest="duration",
+                             type=float, default=10)
+    load_parser.add_argument('--invalid', action="store_true", default=False,
+                             help="publish invalid messages as well")
+    load_parser.add_argument('--fanouts', action="store", dest="fanouts",
+                             type=int, default=20)
+    load_parser.add_argument('--fanout-interval', action="store",
+                             dest="fanout_interval", type=float, default=0.2)
+    load_parser.add_argument('--in-process', action="store_true",
+                             dest="in_process", default=False)
+    load_parser.add_argument('--server-args', action="store",
+                             dest="server_args", type=str, default="",
+                             help="additional mock_server.py arguments "
+                                  "(e.g. \"--send-queue-size 100\")")
+    load_parser.add_argument('--engines', action="store", dest="engines",
+                             nargs="+", choices=Engines.ALL, default=None,
+                             help="compare the server engines")
+    parity_parser = subparsers.add_parser('parity', parents=[common])
+    parity_parser.add_argument('specification_file', action="store",
+                               type=str)
+    parity_parser.add_argument('events_file', action="store", type=str)
+    parity_parser.add_argument('-p', '--port', action="store", dest="port",
+                               type=int, default=18080)
+    parity_parser.add_argument('--settle', action="store", dest="settle",
+                               type=float, default=0.3,
+                               help="seconds to receive the frames sent "
+                                    "after each published message")
+    parity_parser.add_argument('--server-args', action="store",
+                               dest="server_args", type=str, default="")
+    parity_parser.add_argument('--engines', action="store", dest="engines",
+                               nargs="+", choices=Engines.ALL,
+                               default=Engines.ALL)
+    parity_parser.set_defaults(in_process=False)
+    args = parser.parse_args()
+    if args.benchmark == "load" and args.engines and args.in_process:
+        parser.error("--engines require the server in a subprocess")
+
+    logging.basicConfig(format='[%(asctime)s] %(levelname).1s - %(message)s',
+                        level=logging.DEBUG if args.debug else logging.INFO)
+    if args.benchmark == "load" and not args.debug:
+        # keep the in-process server quiet
+        logging.getLogger().setLevel(logging.WARNING)
+        log.setLevel(logging.INFO)
+
+    if args.benchmark == "micro":
+        results = run_micro(args.sizes)
+    elif args.benchmark == "parity":
+        results = run_parity(args)
+    elif args.engines:
+        results = run_engines(args)
+    else:
+        results = run_load(args)
+    print_results(results)
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+    if "differences" in results:
+        print("Engines sent different frames")
+        exit(1)
+
+    if args.baseline:
+        with open(args.baseline, "r") as baseline_file:
+            regressions = compare(results, json.load(baseline_file),
+                                  args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if len(regressions) > 0:
+            exit(1)
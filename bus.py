@@ -0,0 +1,67 @@
+import json
+import logging
+import os
+from typing import Callable, Dict, List
+
+import gevent
+from gevent import socket
+
+log = logging.getLogger(__name__)
+
+# commands are small (references to examples), a datagram is always enough
+MAX_DATAGRAM_SIZE = 65536
+
+
+def worker_address(bus_directory: str, worker_id: int) -> str:
+    return os.path.join(bus_directory, f"worker-{worker_id}.sock")
+
+
+class BroadcastBus:
+    """Local bus between worker processes of a single mock server.
+    Each worker binds a Unix datagram socket in a shared directory
+    and publishes commands to the sockets of all other workers."""
+
+    def __init__(self, bus_directory: str, worker_id: int, workers: int,
+                 handler: Callable[[Dict], None]):
+        self.worker_id = worker_id
+        self.handler = handler
+        self.published = 0
+        self.received = 0
+        self.peers: List[str] = [worker_address(bus_directory, peer_id)
+                                 for peer_id in range(workers)
+                                 if peer_id != worker_id]
+
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.bind(worker_address(bus_directory, worker_id))
+        self._receiver = gevent.spawn(self._receive)
+
+    def publish(self, command: Dict) -> None:
+        """Sends a command (e.g. {"broadcast_example": {...}})
+        to all other workers."""
+        datagram = json.dumps(command).encode()
+        for peer in self.peers:
+            try:
+                self._socket.sendto(datagram, peer)
+            except OSError as e:
+                log.warning(f"Worker {self.worker_id} could not publish "
+                            f"a command to {peer}: {e}")
+        self.published += 1
+
+    def _receive(self):
+        while True:
+            datagram = self._socket.recv(MAX_DATAGRAM_SIZE)
+            self.received += 1
+            command = json.loads(datagram)
+            log.debug(f"Worker {self.worker_id} received a command "
+                      f"from the bus: {command}")
+            try:
+                self.handler(command)
+            except Exception:
+                log.exception(f"Worker {self.worker_id} failed to execute "
+                              f"a command from the bus: {command}")
+
+    def stats(self) -> Dict:
+        return {
+            "published": self.published,
+            "received": self.received,
+        }
@@ -0,0 +1,112 @@
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from registry import channel_key
+
+log = logging.getLogger(__name__)
+
+
+class Chain:
+    """State of a running command chain - all that is kept
+    while the chain waits for the scheduler."""
+    __slots__ = ("name", "channel", "commands", "client", "position",
+                 "cancelled", "state")
+
+    def __init__(self, name: str, channel: str, commands: List[Dict],
+                 client=None):
+        self.name = name
+        self.channel = channel
+        self.commands = commands
+        # connection which sent the message triggering the chain
+        # (None for chains started by other workers)
+        self.client = client
+        # index of the next command to execute
+        self.position = 0
+        self.cancelled = False
+        # state of a command executed across several scheduler ticks
+        self.state = None
+
+
+class ChainRegistry:
+    """Running command chains grouped by (event name, channel),
+    so that they can be stopped immediately and selectively."""
+
+    def __init__(self):
+        self._groups: Dict[Tuple[str, str], Dict[Chain, None]] = {}
+
+    def add(self, chain: Chain) -> None:
+        key = (chain.name, channel_key(chain.channel))
+        self._groups.setdefault(key, {})[chain] = None
+
+    def remove(self, chain: Chain) -> None:
+        key = (chain.name, channel_key(chain.channel))
+        group = self._groups.get(key)
+        if group is None:
+            return
+        group.pop(chain, None)
+        if len(group) == 0:
+            del self._groups[key]
+
+    def stop(self, channel: Optional[str] = None,
+             event_name: Optional[str] = None,
+             exclude: Optional[Chain] = None) -> List[Chain]:
+        """Cancels running chains of the channel and/or of the event
+        (all chains when neither is given). Cancelled chains are dropped
+        by the scheduler without executing any other command, and they
+        release their client and state right away (not at their next tick).
+        :param exclude: chain which keeps running (the one stopping others)
+        :return: stopped chains
+        """
+        keys = [key for key in self._groups.keys()
+                if (event_name is None or key[0] == event_name)
+                and (channel is None or key[1] == channel_key(channel))]
+
+        stopped = []
+        for key in keys:
+            group = self._groups.pop(key)
+            for chain in group:
+                if chain is exclude:
+                    self._groups[key] = {chain: None}
+                else:
+                    chain.cancelled = True
+                    chain.client = None
+                    chain.state = None
+                    stopped.append(chain)
+
+        log.debug(f"Stopped {len(stopped)} command chains "
+                  f"(channel: {channel}, event: {event_name})")
+        return stopped
+
+    def count(self) -> int:
+        return sum(len(group) for group in self._groups.values())
+
+    def counts(self) -> Dict[Tuple[str, str], int]:
+        """:return: number of running chains of each (event name, channel)"""
+        return {key: len(group) for key, group in self._groups.items()}
+
+
+if __name__ == '__main__':
+    # Chain registry assertions (stopping by channel and/or event):
+    ex_1_r = ChainRegistry()
+    ex_1_c = {(ex_1_e, ex_1_ch): Chain(ex_1_e, ex_1_ch, [], client=object())
+              for ex_1_e in ["stream", "reply"]
+              for ex_1_ch in ["chat", "news"]}
+    for ex_1_chain in ex_1_c.values():
+        ex_1_chain.state = {"sent": 1}
+        ex_1_r.add(ex_1_chain)
+
+    assert ex_1_r.stop(channel="/chat", event_name="stream") \
+        == [ex_1_c["stream", "chat"]]
+    assert ex_1_c["stream", "chat"].cancelled
+    assert ex_1_c["stream", "chat"].client is None
+    assert ex_1_c["stream", "chat"].state is None
+    assert ex_1_r.count() == 3 and not ex_1_c["reply", "chat"].cancelled \
+        and ex_1_c["reply", "chat"].client is not None
+
+    assert set(ex_1_r.stop(event_name="reply",
+                           exclude=ex_1_c["reply", "news"])) \
+        == {ex_1_c["reply", "chat"]}
+    assert not ex_1_c["reply", "news"].cancelled
+    assert ex_1_r.counts() == {("stream", "news"): 1, ("reply", "news"): 1}
+
+    assert len(ex_1_r.stop()) == 2 and ex_1_r.count() == 0
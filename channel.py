@@ -1,85 +1,158 @@
-import json
 import logging
-import os
-from typing import List, Iterable, Dict
+from urllib.parse import parse_qs
 
-from geventwebsocket import WebSocketApplication
+from geventwebsocket import WebSocketApplication, WebSocketError
+from geventwebsocket.handler import WebSocketHandler
 
-from command import execute
+from command import MockedWebSocketServer, execute
 from events import EventTypes
-from message import validate_message
+from outbound import SendQueue
 
 log = logging.getLogger(__name__)
 
 
-class ChannelApplication(WebSocketApplication):
+class ChannelConnection:
+    """A client connected to a channel - message handling, validation
+    and event dispatch shared by all server engines. Engines create
+    the connection and call `opened`, `received` and `closed`.
+    Everything derived from the configuration is shared, a connection
+    keeps only its own state."""
+    __slots__ = ("server", "spec_channel", "validation_mode", "tags",
+                 "outbound")
 
-    def __init__(self, ws):
-        super().__init__(ws)
-
-        specification = self.protocol.server.specification
-        channel_names = {os.path.join("/", spec_channel): spec_channel
-                         for spec_channel in specification["channels"].keys()}
-
-        spec_channel = channel_names[self.ws.path]
-        self.specification = specification["channels"][spec_channel]
+    def __init__(self, server: MockedWebSocketServer, path: str,
+                 query_string: str = ""):
+        self.server = server
+        self.spec_channel = server.configuration.paths[path]
+        self.validation_mode = server.validation.mode(self.spec_channel)
+        # tags of the connection, e.g. "/chat?tag=admin&tag=eu"
+        self.tags = tuple(parse_qs(query_string).get("tag", ())) \
+            if query_string else ()
 
-        log.info(f"Initialized WS channel {self.ws.path} ({spec_channel})")
+        log.debug(f"Initialized WS channel {path} ({self.spec_channel})")
 
-    def _get_events_by_type(self, event_type: str) -> List[Dict]:
-        out = []
-        for event_name, event in self.protocol.server.events["events"].items():
+    def send(self, message) -> bool:
+        """Enqueues a message for the client without blocking the caller."""
+        return self.outbound.put(message)
 
-            if event["channel"].replace("/", "") == self.ws.path.replace("/", "")\
-                    and event["when"] == event_type:
-                event["name"] = event_name
-                out.append(event)
-        return out
+    def opened(self, outbound: SendQueue) -> None:
+        self.outbound = outbound
 
-    def on_open(self):
-        log.debug("New client joined")
-
-    def _get_events_for_messages(self, message_names: List[str]) -> Iterable[Dict]:
-        events = self._get_events_by_type(EventTypes.MESSAGE_RECEIVED)
-        return filter(lambda e: any(
-            [e["message_name"] == m for m in message_names]
-        ), events)
+        registry = self.server.registry
+        registry.add(self.spec_channel, self, self.tags)
+        log.debug(f"New client joined ({registry.count(self.spec_channel)} "
+                  f"clients on channel {self.spec_channel})")
 
-    def on_message(self, message, **kwargs):
-        log.debug(f"{self.ws.path} - received a message: {message}")
-        data = json.loads(message)
+    def received(self, message) -> None:
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(f"/{self.spec_channel} - received a message: {message}")
 
+        server = self.server
         try:
-            message_specification = self.specification["publish"]["message"]
+            decode = server.codecs[self.spec_channel]["publish"].decode
         except KeyError:
-            log.error(f"{self.ws.path} - "
-                      f"There is no publish configuration for incoming messages")
-            raise ValueError
-
-        messages = validate_message(data, message_specification,
-                                    self.protocol.server.specification)
-
-        if len(messages) == 0:
-            log.error(f"Sent data did not pass validation "
-                      f"for any of the specified messages")
-            if self.protocol.server.args.strict:
-                log.info("Mock server is going to terminate because of the "
-                         "--strict argument")
-                exit(3)
+            if self.spec_channel not in server.codecs:
+                # the client stays connected until it disconnects
+                log.warning(f"/{self.spec_channel} - The channel has been "
+                            f"removed by a reload, the message is dropped")
             else:
-                log.warning(f"Received message is not a valid publish message "
-                            f"for channel {self.ws.path}. The server will "
-                            f"continue listening, however no message_received "
-                            f"event will be triggered (use --strict to "
-                            f"terminate this server in this situation)")
+                log.error(f"/{self.spec_channel} - There is no publish "
+                          f"configuration for incoming messages, "
+                          f"the message is dropped")
+            return
+
+        server.metrics.messages_received.inc(self.spec_channel)
+
+        # repeated valid frames are not decoded and validated again
+        cache = server.frame_cache
+        key = cache.key(self.spec_channel, message) \
+            if cache is not None else None
+        messages = cache.get(key) if key is not None else None
+
+        if messages is not None:
+            server.metrics.frame_cache.inc("hit")
+            server.validation.account(self.spec_channel, self.validation_mode,
+                                      message, decode)
         else:
-            log.info(f"Following messages passed validation for sent data: {messages}")
-
-        events = self._get_events_for_messages(messages)
+            # decoded once, validation and events work with the decoded data
+            try:
+                data = decode(message)
+            except Exception as e:
+                server.validation.undecodable(self.spec_channel, e)
+                return
+            messages = server.validation.process(
+                self.spec_channel, self.validation_mode, message, data)
+            if key is not None:
+                server.metrics.frame_cache.inc("miss")
+            # invalid frames are validated (and reported) every time
+            if key is not None and len(messages) > 0:
+                if cache.put(key, messages):
+                    server.metrics.frame_cache.inc("eviction")
+
+        events = server.dispatch.lookup(
+            self.spec_channel, EventTypes.MESSAGE_RECEIVED, messages)
 
         for event in events:
-            log.info(f"Executing command chain {event['name']}")
-            execute(event["do"], self.protocol.server)
+            log.info(f"Executing command chain {event.name}")
+            execute(event.commands, server, event.name, event.channel,
+                    client=self)
+
+    def closed(self) -> None:
+        self.server.registry.remove(self.spec_channel, self, self.tags)
+        self.outbound.close()
+        log.debug("Client has disconnected")
+
+
+class ChannelApplication(ChannelConnection, WebSocketApplication):
+    """Channel connection of the gevent engine (gevent-websocket).
+    WebSocketApplication has no __slots__, however its instance dictionary
+    is never created - `ws` is a slot and the protocol object of
+    WebSocketApplication is not needed by `handle`."""
+    __slots__ = ("ws",)
+
+    def __init__(self, ws):
+        self.ws = ws
+        ChannelConnection.__init__(self, ws.handler.server, ws.path,
+                                   ws.environ.get("QUERY_STRING", ""))
+
+    def handle(self):
+        try:
+            self.on_open()
+            while True:
+                try:
+                    message = self.ws.receive()
+                except WebSocketError:
+                    break
+                self.on_message(message)
+        finally:
+            # whichever way the connection ends (also when handling
+            # a message has failed) the client is unregistered
+            self.closed()
+
+    def on_open(self):
+        args = self.server.args
+        self.opened(SendQueue(self.ws, str(self.ws.handler.client_address),
+                              args.send_queue_size, args.send_queue_policy))
+
+    def on_message(self, message, **kwargs):
+        if message is None:
+            # the connection was closed, the next receive ends `handle`
+            return
+        self.received(message)
 
     def on_close(self, reason):
-        log.debug("Client has disconnected")
\ No newline at end of file
+        # the client is closed by `handle`, however the connection ends
+        pass
+
+
+class ChannelHandler(WebSocketHandler):
+    """WebSocket handler of the gevent engine reading from the socket
+    through a buffer of --read-buffer-size bytes (8 KiB by default),
+    which every connection keeps while it is open."""
+
+    def __init__(self, sock, address, server, rfile=None):
+        super().__init__(sock, address, server, rfile)
+        size = server.args.read_buffer_size
+        if rfile is None and size is not None:
+            self.rfile.close()
+            self.rfile = sock.makefile("rb", size)
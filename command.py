@@ -1,115 +1,544 @@
 import argparse
-import json
+import itertools
 import logging
+import math
 import time
-from typing import List, Dict
+from collections import OrderedDict
+from typing import List, Dict, Iterable, Optional, Tuple, TYPE_CHECKING
 
-import gevent
 from geventwebsocket import WebSocketServer
 
-from message import dereference, validate_message
+from bus import BroadcastBus
+from chains import Chain, ChainRegistry
+from compiler import MessageValidator
+from events import DispatchIndex
+from examples import Example, ExampleCache
+from frames import FrameCache
+from generator import DEFAULT_POOL_SIZE, DEFAULT_SEED, GeneratedPool, \
+    GeneratedPools
+from metrics import Metrics
+from outbound import PreparedFrame
+from registry import ChannelRegistry, channel_key
+from scheduler import Scheduler
+from wire import ChannelCodec
+
+if TYPE_CHECKING:
+    from configuration import Configuration
+    from profiling import Profiler
+    from validation import Validation
 
 log = logging.getLogger(__name__)
 
 
 class MockedWebSocketServer(WebSocketServer):
     """Just a helper class for type hinting."""
+    configuration: "Configuration"
+    # paths of the Resource application
+    routes: OrderedDict
     specification: Dict
     events: Dict
-    valid_command_chain_time: float
+    dispatch: DispatchIndex
+    validators: Dict[str, Dict[str, MessageValidator]]
+    classifiers: Dict[str, Dict[str, MessageValidator]]
+    codecs: Dict[str, Dict[str, ChannelCodec]]
+    registry: ChannelRegistry
+    examples: ExampleCache
+    generated: GeneratedPools
+    metrics: Metrics
+    chains: ChainRegistry
+    scheduler: Scheduler
+    validation: "Validation"
+    frame_cache: Optional[FrameCache]
     args: argparse.Namespace
+    # set only in the --workers mode
+    worker_id: Optional[int]
+    bus: Optional[BroadcastBus]
+    # resident memory before any client connected
+    memory_baseline: int
+    # set only with --profile
+    profiler: Optional["Profiler"]
 
 
 class Commands:
     WAIT = "wait"
     BROADCAST_EXAMPLE = "broadcast_example"
     STOP_COMMAND_CHAINS = "stop_command_chains"
+    STREAM_EXAMPLES = "stream_examples"
+    BROADCAST_GENERATED = "broadcast_generated"
+    REPLY_EXAMPLE = "reply_example"
 
     @staticmethod
     def execute_wait(command: Dict, server: MockedWebSocketServer,
                      **kwargs) -> Dict:
         log.debug(f"Executing command WAIT for {command['seconds']} seconds")
-        gevent.sleep(command["seconds"])
-        return {}
+        # the chain is resumed by the scheduler
+        return {
+            "wait": command["seconds"]
+        }
 
     @staticmethod
     def execute_broadcast_example(command: Dict, server: MockedWebSocketServer,
+                                  remote: bool = False,
+                                  batch: "BroadcastBatch" = None,
                                   **kwargs) -> Dict:
         log.debug(f"Executing command BROADCAST_EXAMPLE "
                   f"with example: {command['example_ref']}")
 
-        example = dereference(command["example_ref"], server.specification)
-        example_data = example["value"]
-
-        messages = validate_message(example_data,
-                                    server.specification[
-                                        "channels"][command["channel"]][
-                                        "subscribe"]["message"],
-                                    server.specification)
-
-        if len(messages) == 0:
-            log.error(f"Provided example {command['example_ref']} is not valid"
-                      f"in any subscribe message specification "
-                      f"for channel {command['channel']}")
-            if server.args.strict:
-                log.info("Mock server is going to terminate because of the "
-                         "--strict argument")
-                exit(3)
+        if server.bus is not None and not remote:
+            # clients of the channel are connected to other workers as well
+            server.bus.publish({Commands.BROADCAST_EXAMPLE: command})
+
+        example = example_to_send(server, command["channel"],
+                                  command["example_ref"])
+        if batch is not None:
+            batch.add(command["channel"], example.frame)
+        else:
+            broadcast(server, command["channel"], [example.frame])
+        return {}
+
+    @staticmethod
+    def execute_stop_command_chains(command: Dict,
+                                    server: MockedWebSocketServer,
+                                    remote: bool = False,
+                                    chain: Chain = None, **kwargs) -> Dict:
+        # no scope (e.g. `stop_command_chains: []`) stops all chains
+        scope = command if isinstance(command, dict) else {}
+        log.debug(f"Executing command chain stop (scope: {scope})")
+
+        if server.bus is not None and not remote:
+            server.bus.publish({Commands.STOP_COMMAND_CHAINS: command})
+        stopped = server.chains.stop(channel=scope.get("channel"),
+                                     event_name=scope.get("event"),
+                                     exclude=chain)
+        for stopped_chain in stopped:
+            server.metrics.command_chains.inc(stopped_chain.name, "stopped")
+        return {
+            "stopped": len(stopped)
+        }
+
+    @staticmethod
+    def execute_stream_examples(command: Dict, server: MockedWebSocketServer,
+                                remote: bool = False, chain: Chain = None,
+                                batch: "BroadcastBatch" = None,
+                                **kwargs) -> Dict:
+        """Sends the examples (or payloads generated for the message
+        of `message_ref`) one after another at the given rate
+        for the given duration (or count). The command is executed again
+        at every scheduler tick a message is due - the messages due are
+        counted from the start of the stream, so the pacing does not drift
+        and all messages due at the same tick are sent together."""
+        if chain is None:
+            # started by another worker - stream to the clients of this one
+            execute([{Commands.STREAM_EXAMPLES: command}], server,
+                    command.get("event"), command.get("event_channel"))
+            return {}
+
+        now = time.monotonic()
+        state = chain.state
+        if state is None:
+            log.debug(f"Executing command STREAM_EXAMPLES "
+                      f"with examples: {stream_references(command)}"
+                      f"{generated_pool_description(command)}")
+            # streams started by other workers are not published back
+            if server.bus is not None and not remote \
+                    and not command.get("remote"):
+                server.bus.publish({Commands.STREAM_EXAMPLES: dict(
+                    command, remote=True, event=chain.name,
+                    event_channel=chain.channel)})
+
+            total = command["count"] if "count" in command \
+                else math.ceil(command["duration"] * command["rate"])
+            if "message_ref" in command:
+                frames = pool_to_send(server, command).next
             else:
-                log.warning(f"Example {command['example_ref']} will be sent "
-                            f"even though it is not a valid subscribe message "
-                            f"(use --strict to force the validation)")
+                frames = itertools.cycle([
+                    example_to_send(server, command["channel"],
+                                    example_ref).frame
+                    for example_ref in stream_references(command)]).__next__
+            state = {
+                "start": now,
+                "sent": 0,
+                "total": total,
+                # returns the next frame of the stream
+                "frames": frames,
+            }
+            chain.state = state
 
-        for client in server.clients.values():
+        rate = command["rate"]
+        due = min(state["total"], math.floor((now - state["start"]) * rate) + 1)
+        frames = [state["frames"]() for _ in range(state["sent"], due)]
+        state["sent"] = due
 
-            channel_path = client.ws.path
+        if batch is not None:
+            for frame in frames:
+                batch.add(command["channel"], frame)
+        elif len(frames) > 0:
+            broadcast(server, command["channel"], frames)
 
-            if channel_path.replace("/", "") == command["channel"].replace("/", ""):
-                client.ws.send(json.dumps(example_data))
-                log.debug(f"Sent example {command['example_ref']} to a client "
-                          f"using channel {command['channel']}")
-        return {}
+        if state["sent"] >= state["total"]:
+            chain.state = None
+            return {}
+
+        return {
+            "wait": state["start"] + state["sent"] / rate - now,
+            "repeat": True
+        }
 
     @staticmethod
-    def execute_stop_command_chains(command: Dict,
+    def execute_broadcast_generated(command: Dict,
                                     server: MockedWebSocketServer,
+                                    remote: bool = False,
+                                    batch: "BroadcastBatch" = None,
                                     **kwargs) -> Dict:
-        log.debug("Executing command chain stop")
-        server.valid_command_chain_time = time.time()
+        log.debug(f"Executing command BROADCAST_GENERATED "
+                  f"with message: {command['message_ref']}")
+
+        if server.bus is not None and not remote:
+            server.bus.publish({Commands.BROADCAST_GENERATED: command})
+
+        pool = pool_to_send(server, command)
+        frames = [pool.next() for _ in range(command.get("count", 1))]
+        if batch is not None:
+            for frame in frames:
+                batch.add(command["channel"], frame)
+        else:
+            broadcast(server, command["channel"], frames)
+        return {}
+
+    @staticmethod
+    def execute_reply_example(command: Dict, server: MockedWebSocketServer,
+                              remote: bool = False, chain: Chain = None,
+                              batch: "BroadcastBatch" = None,
+                              **kwargs) -> Dict:
+        """Sends the example only to the client which sent the message
+        triggering the chain or, with a `tag`, to the clients of the channel
+        connected with the tag - unlike broadcasts, the cost depends
+        on the number of recipients only."""
+        channel = command.get("channel") or chain.channel
+        tag = command.get("tag")
+        log.debug(f"Executing command REPLY_EXAMPLE "
+                  f"with example: {command['example_ref']} "
+                  f"(tag: {tag})")
+
+        if tag is None:
+            if chain is None or chain.client is None:
+                log.warning(f"Example {command['example_ref']} has no client "
+                            f"to reply to (the chain was not started "
+                            f"by a received message)")
+                return {}
+            clients = [chain.client]
+        else:
+            if server.bus is not None and not remote:
+                # clients with the tag are connected to other workers as well
+                server.bus.publish({Commands.REPLY_EXAMPLE: dict(
+                    command, channel=channel)})
+            clients = server.registry.tagged(channel, tag)
+
+        example = example_to_send(server, channel, command["example_ref"])
+        if batch is not None:
+            # frames of the previous commands are sent first
+            batch.flush(server)
+        broadcast(server, channel, [example.frame], clients)
         return {
-            "start_time": time.time()
+            "recipients": len(clients)
         }
 
 
-def execute_command(command: Dict, server: MockedWebSocketServer) -> Dict:
+def broadcast(server: MockedWebSocketServer, channel: str,
+              messages: List[PreparedFrame],
+              clients: Optional[Iterable] = None) -> None:
+    """Queues the messages for all clients of the channel
+    (the same frames for every client).
+    :param clients: only these clients of the channel
+    """
+    start = time.perf_counter()
+    if clients is None:
+        clients = server.registry.subscribers(channel)
+    for client in clients:
+        for message in messages:
+            client.send(message)
+    log.debug(f"Queued {len(messages)} messages for {len(clients)} clients "
+              f"using channel {channel}")
+    server.metrics.broadcast_seconds.observe(time.perf_counter() - start,
+                                             channel_key(channel))
+    server.metrics.broadcast_recipients.observe(len(clients),
+                                                channel_key(channel))
+
+
+class BroadcastBatch:
+    """Broadcasts of all chains run by the scheduler at the same tick,
+    sent together per channel."""
+
+    def __init__(self):
+        self.messages: Dict[str, List[PreparedFrame]] = {}
+
+    def add(self, channel: str, message: PreparedFrame) -> None:
+        self.messages.setdefault(channel_key(channel), []).append(message)
+
+    def flush(self, server: MockedWebSocketServer) -> None:
+        for channel, messages in self.messages.items():
+            broadcast(server, channel, messages)
+        self.messages = {}
+
+
+def example_to_send(server: MockedWebSocketServer, channel: str,
+                    example_ref: str) -> Example:
+    """:return: the example, when it is valid or not validated strictly"""
+    example = server.examples.get(channel, example_ref)
+
+    if not example.is_valid:
+        if server.args.strict:
+            log.info("Mock server is going to terminate because of the "
+                     "--strict argument")
+            exit(3)
+        else:
+            log.warning(f"Example {example_ref} will be sent "
+                        f"even though it is not a valid subscribe message "
+                        f"(use --strict to force the validation)")
+    return example
+
+
+def pool_to_send(server: MockedWebSocketServer,
+                 command: Dict) -> GeneratedPool:
+    """:return: the pool of generated payloads of a broadcast_generated
+    or stream_examples command, when they are valid or not validated
+    strictly"""
+    pool = server.generated.get(*generated_pool_reference(command))
+
+    if pool.invalid > 0:
+        if server.args.strict:
+            log.info("Mock server is going to terminate because of the "
+                     "--strict argument")
+            exit(3)
+        else:
+            log.warning(f"Payloads generated for message "
+                        f"{command['message_ref']} will be sent even though "
+                        f"{pool.invalid} of them are not valid subscribe "
+                        f"messages (use --strict to force the validation)")
+    return pool
+
+
+def stream_references(command: Dict) -> List[str]:
+    """:return: example references of a stream_examples command"""
+    if "example_refs" in command:
+        return command["example_refs"]
+    return [command["example_ref"]] if "example_ref" in command else []
+
+
+def generated_pool_reference(command: Dict) -> Tuple[str, str, int, int]:
+    """:return: (channel, message_ref, pool_size, seed) of a command
+    sending generated payloads"""
+    return command["channel"], command["message_ref"], \
+        command.get("pool_size", DEFAULT_POOL_SIZE), \
+        command.get("seed", DEFAULT_SEED)
+
+
+def generated_pool_description(command: Dict) -> str:
+    if "message_ref" not in command:
+        return ""
+    _, message_ref, size, seed = generated_pool_reference(command)
+    return f" and {size} payloads of {message_ref} generated with seed {seed}"
+
+
+def referenced_examples(events: Dict) -> Iterable[Tuple[str, str]]:
+    """:return: (channel, example_ref) of every example sent by
+    broadcast_example, reply_example and stream_examples commands
+    in the events configuration"""
+    for event in events["events"].values():
+        for command in event["do"]:
+            command_name = next(iter(command.keys()))
+            if command_name == Commands.BROADCAST_EXAMPLE:
+                yield command[command_name]["channel"], \
+                    command[command_name]["example_ref"]
+            elif command_name == Commands.REPLY_EXAMPLE:
+                yield command[command_name].get("channel") \
+                    or event["channel"], command[command_name]["example_ref"]
+            elif command_name == Commands.STREAM_EXAMPLES:
+                for example_ref in stream_references(command[command_name]):
+                    yield command[command_name]["channel"], example_ref
+
+
+def invalid_commands(events: Dict) -> List[str]:
+    """:return: descriptions of the commands in the events configuration
+    which cannot be executed with their settings"""
+    invalid = []
+    for event_name, event in events["events"].items():
+        for command in event["do"]:
+            command_name = next(iter(command.keys()))
+            settings = command[command_name]
+            if command_name == Commands.BROADCAST_GENERATED \
+                    or command_name == Commands.STREAM_EXAMPLES \
+                    and "message_ref" in settings:
+                pool_size = settings.get("pool_size", DEFAULT_POOL_SIZE)
+                if not isinstance(pool_size, int) or pool_size < 1:
+                    invalid.append(f"{command_name} of event {event_name} "
+                                   f"needs a pool_size of at least 1")
+            if command_name != Commands.STREAM_EXAMPLES:
+                continue
+            rate = settings.get("rate")
+            if not isinstance(rate, (int, float)) or rate <= 0:
+                invalid.append(f"{command_name} of event {event_name} "
+                               f"needs a rate above 0 (messages per second)")
+            if "count" not in settings and "duration" not in settings:
+                invalid.append(f"{command_name} of event {event_name} "
+                               f"needs a count or a duration")
+            if len(stream_references(settings)) == 0 \
+                    and "message_ref" not in settings:
+                invalid.append(f"{command_name} of event {event_name} "
+                               f"needs example_refs or a message_ref")
+    return invalid
+
+
+def referenced_generated(events: Dict) -> Iterable[Tuple[str, str, int, int]]:
+    """:return: (channel, message_ref, pool_size, seed) of every pool
+    of generated payloads sent by broadcast_generated and stream_examples
+    commands in the events configuration"""
+    for event in events["events"].values():
+        for command in event["do"]:
+            command_name = next(iter(command.keys()))
+            if command_name == Commands.BROADCAST_GENERATED \
+                    or command_name == Commands.STREAM_EXAMPLES \
+                    and "message_ref" in command[command_name]:
+                yield generated_pool_reference(command[command_name])
+
+
+def execute_command(command: Dict, server: MockedWebSocketServer,
+                    **kwargs) -> Dict:
     command_name = next(iter(command.keys()))
     command_data = command[command_name]
 
     if command_name == Commands.WAIT:
-        return Commands.execute_wait(command_data, server)
+        return Commands.execute_wait(command_data, server, **kwargs)
     elif command_name == Commands.BROADCAST_EXAMPLE:
-        return Commands.execute_broadcast_example(command_data, server)
+        return Commands.execute_broadcast_example(command_data, server,
+                                                  **kwargs)
     elif command_name == Commands.STOP_COMMAND_CHAINS:
-        return Commands.execute_stop_command_chains(command_data, server)
+        return Commands.execute_stop_command_chains(command_data, server,
+                                                    **kwargs)
+    elif command_name == Commands.STREAM_EXAMPLES:
+        return Commands.execute_stream_examples(command_data, server,
+                                                **kwargs)
+    elif command_name == Commands.BROADCAST_GENERATED:
+        return Commands.execute_broadcast_generated(command_data, server,
+                                                    **kwargs)
+    elif command_name == Commands.REPLY_EXAMPLE:
+        return Commands.execute_reply_example(command_data, server, **kwargs)
     else:
         # todo: More commands in the future
         raise NotImplementedError(
             f"Command {command_name} is not implemented in this version")
 
 
-def execute_commands(commands: List[Dict], server: MockedWebSocketServer) -> None:
-    start_time = time.time()
+def run_chains(chains: List[Chain], server: MockedWebSocketServer) -> None:
+    """Executes commands of the chains until their next wait or end
+    (called by the scheduler with all chains due at the same tick)."""
+    batch = BroadcastBatch()
+    profiler = server.profiler
 
-    for i, command in enumerate(commands):
-        if start_time > server.valid_command_chain_time:
-            output = execute_command(command, server)
-            if "start_time" in output:
-                start_time = output["start_time"]
-        else:
-            log.debug(f"Command chain stopped execution prematurely "
-                      f"after {i} executions from {len(commands)}")
-            break
+    for chain in chains:
+        if chain.cancelled:
+            if profiler is not None:
+                profiler.chain_finished(chain, "stopped")
+            continue
+
+        try:
+            while chain.position < len(chain.commands):
+                command = chain.commands[chain.position]
+                chain.position += 1
+                if profiler is not None:
+                    start = time.perf_counter()
+                output = execute_command(command, server, chain=chain,
+                                         batch=batch)
+                if profiler is not None:
+                    profiler.command_executed(
+                        next(iter(command.keys())),
+                        time.perf_counter() - start, chain)
+                if output.get("repeat"):
+                    # the command continues when the chain is resumed
+                    chain.position -= 1
+                if "wait" in output:
+                    server.scheduler.schedule(chain, output["wait"])
+                    break
+            else:
+                server.chains.remove(chain)
+                server.metrics.command_chains.inc(chain.name, "completed")
+                if profiler is not None:
+                    profiler.chain_finished(chain, "completed")
+        except Exception:
+            log.exception(f"Command chain {chain.name} failed "
+                          f"at command {chain.position}")
+            server.chains.remove(chain)
+            server.metrics.command_chains.inc(chain.name, "failed")
+            if profiler is not None:
+                profiler.chain_finished(chain, "failed")
+
+    if profiler is not None:
+        start = time.perf_counter()
+    batched = len(batch.messages) > 0
+    batch.flush(server)
+    if profiler is not None and batched:
+        # broadcasts of the chains are timed here, not by their commands
+        profiler.command_executed("batched_broadcasts",
+                                  time.perf_counter() - start)
+
+
+def execute(commands: List[Dict], server: MockedWebSocketServer,
+            name: str = None, channel: str = None, client=None) -> None:
+    """:param client: connection which sent the message triggering
+    the commands (the recipient of replies)"""
+    chain = Chain(name, channel, commands, client)
+    server.chains.add(chain)
+    server.metrics.command_chains.inc(name, "started")
+    if server.profiler is not None:
+        server.profiler.chain_started(chain)
+    server.scheduler.call_soon(chain)
+
+
+if __name__ == '__main__':
+    from types import SimpleNamespace
+
+    # Command order assertions (replies after the batched broadcasts):
+
+    class RecordingClient:
+        def __init__(self):
+            self.received = []
+
+        def send(self, message):
+            self.received.append(message.message)
+
+    ex_1_examples = {"simple": Example("chat", "simple", "Hello World",
+                                       "Hello World", ["Text"]),
+                     "long": Example("chat", "long", "The quick brown fox",
+                                     "The quick brown fox", ["Text"])}
+    ex_1_s = SimpleNamespace(
+        examples=SimpleNamespace(get=lambda channel, ref: ex_1_examples[ref]),
+        registry=ChannelRegistry(), chains=ChainRegistry(), bus=None,
+        profiler=None, args=SimpleNamespace(strict=False))
+    ex_1_s.metrics = Metrics(ex_1_s)
+    ex_1_c = RecordingClient()
+    ex_1_s.registry.add("chat", ex_1_c)
+    run_chains([Chain("reply", "chat", [
+        {Commands.BROADCAST_EXAMPLE: {"channel": "chat",
+                                      "example_ref": "simple"}},
+        {Commands.REPLY_EXAMPLE: {"example_ref": "long"}},
+        {Commands.BROADCAST_EXAMPLE: {"channel": "chat",
+                                      "example_ref": "simple"}},
+    ], ex_1_c)], ex_1_s)
+    assert ex_1_c.received == ["Hello World", "The quick brown fox",
+                               "Hello World"], ex_1_c.received
 
+    # Command settings assertions:
 
-def execute(commands: List[Dict], server: MockedWebSocketServer) -> None:
-    gevent.spawn(execute_commands, commands=commands, server=server)
+    ex_2_e = {"events": {"stream": {"do": [
+        {Commands.STREAM_EXAMPLES: {"channel": "chat", "rate": 0,
+                                    "example_refs": ["simple"]}},
+        {Commands.STREAM_EXAMPLES: {"channel": "chat", "rate": 10}},
+        {Commands.STREAM_EXAMPLES: {"channel": "chat", "rate": 10,
+                                    "count": 5, "example_ref": "simple"}},
+    ]}}}
+    assert len(invalid_commands(ex_2_e)) == 4, invalid_commands(ex_2_e)
+    ex_2_e["events"]["stream"]["do"] = [
+        {Commands.BROADCAST_GENERATED: {"channel": "chat",
+                                        "message_ref": "image",
+                                        "pool_size": 0}}]
+    assert len(invalid_commands(ex_2_e)) == 1
@@ -0,0 +1,402 @@
+from typing import Any, Dict, Callable, Iterable, List, Optional
+import logging
+
+from discriminator import Discriminator, payload_shape
+from message import dereference
+
+log = logging.getLogger(__name__)
+
+PayloadValidator = Callable[[Any], bool]
+MessageValidator = Callable[[Any], List[str]]
+
+
+def _unsupported(payload_specification: Dict) -> PayloadValidator:
+    def validate(payload: Any) -> bool:
+        # same as the reference validator - fail only when a payload
+        # actually reaches the unsupported part of the specification
+        raise NotImplementedError(
+            f"Payload specification {payload_specification} "
+            f"is not yet supported by this validator")
+    return validate
+
+
+def _compile_reference(reference: str, full_specification: Dict,
+                       references: Dict[str, Optional[PayloadValidator]]
+                       ) -> PayloadValidator:
+    if reference in references:
+        compiled = references[reference]
+        if compiled is not None:
+            return compiled
+
+        # recursive schema - resolve the validator once it is compiled
+        return lambda payload: references[reference](payload)
+
+    references[reference] = None
+    compiled = compile_payload(dereference(reference, full_specification),
+                               full_specification, references)
+    references[reference] = compiled
+    return compiled
+
+
+def _compile_enum(enum_values: List, validate_type: PayloadValidator
+                  ) -> PayloadValidator:
+    try:
+        enum_set = frozenset(enum_values)
+    except TypeError:
+        # unhashable enum values (objects, lists) - use the list as it is
+        return lambda payload: payload in enum_values \
+            and validate_type(payload)
+
+    def validate(payload: Any) -> bool:
+        try:
+            is_member = payload in enum_set
+        except TypeError:
+            is_member = payload in enum_values
+        return is_member and validate_type(payload)
+    return validate
+
+
+def _compile_integer(payload_specification: Dict) -> PayloadValidator:
+    minimum = payload_specification.get("minimum")
+    maximum = payload_specification.get("maximum")
+
+    if minimum is None and maximum is None:
+        return lambda payload: isinstance(payload, int)
+    if maximum is None:
+        return lambda payload: isinstance(payload, int) and payload >= minimum
+    if minimum is None:
+        return lambda payload: isinstance(payload, int) and payload <= maximum
+    return lambda payload: isinstance(payload, int) \
+        and minimum <= payload <= maximum
+
+
+def _compile_object(payload_specification: Dict, full_specification: Dict,
+                    references: Dict[str, Optional[PayloadValidator]]
+                    ) -> PayloadValidator:
+    if "properties" not in payload_specification:
+        # the reference validator rejects every payload in this case
+        return lambda payload: False
+
+    properties = tuple(
+        (prop, compile_payload(prop_specification, full_specification,
+                               references))
+        for prop, prop_specification
+        in payload_specification["properties"].items())
+
+    def validate(payload: Any) -> bool:
+        if not isinstance(payload, dict):
+            return False
+        for prop, validate_property in properties:
+            if prop not in payload or not validate_property(payload[prop]):
+                return False
+        return True
+    return validate
+
+
+def compile_payload(payload_specification: Dict, full_specification: Dict,
+                    references: Dict[str, Optional[PayloadValidator]] = None
+                    ) -> PayloadValidator:
+    """Compiles a payload specification into a validator callable.
+    All `$ref`s are resolved and all constraints are bound in advance,
+    so that the validator does not touch the specification again.
+    :param references: already compiled `$ref` validators (shared between
+    compilations of the same specification)
+    :return callable returning True when the payload is valid (same result as
+    `message.validate_payload` without raising an AssertionError)
+    """
+    if references is None:
+        references = {}
+
+    if "type" not in payload_specification:
+        # no type in specification -> look for $ref or oneOf
+
+        if "$ref" in payload_specification:
+            return _compile_reference(payload_specification["$ref"],
+                                      full_specification, references)
+        elif "oneOf" in payload_specification:
+            one_of = tuple(compile_payload(spec, full_specification,
+                                           references)
+                           for spec in payload_specification["oneOf"])
+            if len(one_of) < 2:
+                return lambda payload: any(validate(payload)
+                                           for validate in one_of)
+
+            discriminator = Discriminator([
+                payload_shape(spec, full_specification)
+                for spec in payload_specification["oneOf"]])
+            return lambda payload: any(
+                one_of[i](payload) for i in discriminator.candidates(payload))
+        return _unsupported(payload_specification)
+
+    payload_type = payload_specification["type"]
+
+    if payload_type == "string":
+        validate_type = lambda payload: isinstance(payload, str)
+    elif payload_type == "integer":
+        validate_type = _compile_integer(payload_specification)
+    elif payload_type == "number":
+        validate_type = lambda payload: isinstance(payload, float)
+    elif payload_type == "object":
+        validate_type = _compile_object(payload_specification,
+                                        full_specification, references)
+    else:
+        # todo: do more types
+        validate_type = _unsupported(payload_specification)
+
+    if "enum" in payload_specification:
+        return _compile_enum(payload_specification["enum"], validate_type)
+    return validate_type
+
+
+def message_specs(message_specification: Dict,
+                  full_specification: Dict) -> List[Dict]:
+    """:return: dereferenced specifications of the messages
+    of a publish or subscribe operation"""
+    if "oneOf" in message_specification:
+        specs = message_specification["oneOf"]
+    else:
+        if "$ref" not in message_specification:
+            message_specification = message_specification[
+                next(iter(message_specification.keys()))]
+        specs = [message_specification]
+
+    return [dereference(message_spec["$ref"], full_specification)
+            if "$ref" in message_spec else message_spec
+            for message_spec in specs]
+
+
+def compile_message(message_specification: Dict, full_specification: Dict,
+                    references: Dict[str, Optional[PayloadValidator]] = None
+                    ) -> MessageValidator:
+    """Compiles a message specification (of a publish or subscribe operation)
+    into a validator callable.
+    :return: callable returning the same list of message names
+    as `message.validate_message`
+    """
+    if references is None:
+        references = {}
+
+    specs = message_specs(message_specification, full_specification)
+    messages = tuple((message_spec["name"],
+                      compile_payload(message_spec["payload"],
+                                      full_specification, references))
+                     for message_spec in specs)
+
+    if len(messages) < 2:
+        return lambda message_data: [message_name
+                                     for message_name, validate in messages
+                                     if validate(message_data)]
+
+    # validate only against the messages the data could possibly match
+    discriminator = Discriminator([
+        payload_shape(message_spec["payload"], full_specification)
+        for message_spec in specs])
+
+    def validate_message(message_data: Any) -> List[str]:
+        return [messages[i][0] for i in discriminator.candidates(message_data)
+                if messages[i][1](message_data)]
+    return validate_message
+
+
+def compile_classifier(message_specification: Dict,
+                       full_specification: Dict) -> MessageValidator:
+    """Compiles a message specification into a cheap classifier
+    which does not validate payloads.
+    :return: callable returning names of the messages a payload could be
+    by its JSON type, required properties and enum values
+    """
+    specs = message_specs(message_specification, full_specification)
+    names = [message_spec["name"] for message_spec in specs]
+    discriminator = Discriminator([
+        payload_shape(message_spec["payload"], full_specification)
+        for message_spec in specs])
+
+    def classify(message_data: Any) -> List[str]:
+        return [names[i] for i in discriminator.candidates(message_data)]
+    return classify
+
+
+def compile_channels(full_specification: Dict,
+                     channels: Optional[Iterable[str]] = None,
+                     references: Dict[str, Optional[PayloadValidator]] = None
+                     ) -> Dict[str, Dict[str, MessageValidator]]:
+    """Compiles publish and subscribe message specifications of all channels.
+    :param channels: names of the channels to compile (default all)
+    :param references: validators of referenced payloads compiled earlier,
+    filled with the newly compiled ones
+    :return: {channel_name: {"publish": validator, "subscribe": validator}},
+    operations without a message specification are omitted
+    """
+    if references is None:
+        references = {}
+    if channels is None:
+        channels = full_specification["channels"].keys()
+
+    compiled = {}
+    for channel_name in channels:
+        channel = full_specification["channels"][channel_name]
+        compiled[channel_name] = {
+            operation: compile_message(channel[operation]["message"],
+                                       full_specification, references)
+            for operation in ("publish", "subscribe")
+            if operation in channel and "message" in channel[operation]
+        }
+        log.debug(f"Compiled validators for channel {channel_name}: "
+                  f"{list(compiled[channel_name].keys())}")
+    return compiled
+
+
+def compile_classifiers(full_specification: Dict,
+                        channels: Optional[Iterable[str]] = None
+                        ) -> Dict[str, Dict[str, MessageValidator]]:
+    """Compiles classifiers (see `compile_classifier`) of the publish
+    and subscribe messages of all channels (or of the given channels).
+    :return: {channel_name: {"publish": classifier, "subscribe": classifier}}
+    """
+    if channels is None:
+        channels = full_specification["channels"].keys()
+
+    return {
+        channel_name: {
+            operation: compile_classifier(
+                full_specification["channels"][channel_name][operation][
+                    "message"], full_specification)
+            for operation in ("publish", "subscribe")
+            if operation in full_specification["channels"][channel_name]
+            and "message" in full_specification["channels"][channel_name][
+                operation]
+        }
+        for channel_name in channels
+    }
+
+
+if __name__ == '__main__':
+    import os
+
+    from yaml import Loader, load
+
+    from message import validate_message, validate_payload
+
+    # Payload assertions (compiled vs. reference validator):
+
+    def reference_result(payload: Any, payload_specification: Dict,
+                         full_specification: Dict) -> bool:
+        try:
+            return validate_payload(payload, payload_specification,
+                                    full_specification)
+        except AssertionError:
+            return False
+
+    ex_1_s = {
+        "type": "object",
+        "properties": {
+            "name": {"type": "string"},
+            "type": {"type": "string", "enum": ["cat", "dog"]},
+            "weight": {"type": "integer", "minimum": 0, "maximum": 100}
+        }
+    }
+    ex_1_f = {"components": {"schemas": {"animal": ex_1_s}}}
+    ex_1_r = {"oneOf": [{"$ref": "#/components/schemas/animal"},
+                        {"type": "number"}]}
+
+    for ex_1_p in [{"name": "Tom", "type": "cat", "weight": 5},
+                   {"name": "Paws", "type": "fox", "weight": 7},
+                   {"name": "Chonker", "type": "cat", "weight": 101},
+                   {"name": "Ghost", "type": "dog", "weight": -1},
+                   {"name": "Tom", "type": "cat"}, "text", []]:
+        assert compile_payload(ex_1_r, ex_1_f)(ex_1_p) == \
+            reference_result(ex_1_p, ex_1_r, ex_1_f), ex_1_p
+
+    # recursive schemas compile lazily
+    ex_2_f = {"components": {"schemas": {"node": {
+        "oneOf": [{"type": "integer"},
+                  {"type": "object",
+                   "properties": {"child": {"$ref": "#/components/schemas/node"}}}]
+    }}}}
+    ex_2_v = compile_payload({"$ref": "#/components/schemas/node"}, ex_2_f)
+    assert ex_2_v({"child": {"child": 3}})
+    assert not ex_2_v({"child": {"child": "3"}})
+
+    # Message assertions on the example specification:
+
+    specification_path = os.path.join(os.path.dirname(__file__),
+                                      "example-config", "specification.yaml")
+    with open(specification_path, "r") as specification_file:
+        ex_3_f = load(specification_file, Loader=Loader)
+
+    ex_3_payloads = ["hello world", "", [],
+                     {"url": "https://picsum.photos/1", "size": 1},
+                     {"url": "https://picsum.photos/1", "size": -1},
+                     {"url": "https://picsum.photos/1", "size": "1"},
+                     {"url": 1, "size": 1},
+                     {"url": "https://picsum.photos/1"}]
+    for ex_3_message in ex_3_f["components"]["messages"].values():
+        ex_3_payloads.extend(example["value"] for example
+                             in ex_3_message.get("examples", {}).values())
+
+    ex_3_c = compile_channels(ex_3_f)
+    for ex_3_name, ex_3_channel in ex_3_f["channels"].items():
+        for ex_3_operation in ("publish", "subscribe"):
+            ex_3_s = ex_3_channel[ex_3_operation]["message"]
+            for ex_3_p in ex_3_payloads:
+                assert ex_3_c[ex_3_name][ex_3_operation](ex_3_p) == \
+                    validate_message(ex_3_p, ex_3_s, ex_3_f), ex_3_p
+
+    # Discriminated oneOf (compiled vs. reference validator):
+
+    ex_4_f = {"components": {"messages": {}, "schemas": {
+        "kind": {"type": "string", "enum": ["a", "b", "c"]}}}}
+    for ex_4_i in range(20):
+        ex_4_f["components"]["messages"][f"m{ex_4_i}"] = {
+            "name": f"Message{ex_4_i}",
+            "payload": {
+                "type": "object",
+                "properties": {
+                    "action": {"type": "string", "enum": [f"action{ex_4_i}"]},
+                    "kind": {"$ref": "#/components/schemas/kind"},
+                    f"field{ex_4_i % 3}": {"type": "integer", "minimum": 0}
+                }
+            }
+        }
+    ex_4_f["components"]["messages"]["text"] = {
+        "name": "Text", "payload": {"type": "string"}}
+    ex_4_f["components"]["messages"]["status"] = {
+        "name": "Status", "payload": {"type": "string", "enum": ["ok"]}}
+    ex_4_s = {"oneOf": [{"$ref": f"#/components/messages/{name}"}
+                        for name in ex_4_f["components"]["messages"]]}
+
+    ex_4_payloads = ["ok", "text", [],
+                     {"action": "action3", "kind": "a", "field0": 1},
+                     {"action": "action3", "kind": "a", "field1": 1},
+                     {"action": "action3", "kind": "d", "field0": 1},
+                     {"action": "action4", "kind": "b", "field1": -1},
+                     {"action": "unknown", "kind": "b", "field1": 1},
+                     {"action": ["action4"], "kind": "b", "field1": 1},
+                     {"kind": "b", "field1": 1}]
+    ex_4_v = compile_message(ex_4_s, ex_4_f)
+    for ex_4_p in ex_4_payloads:
+        assert ex_4_v(ex_4_p) == validate_message(ex_4_p, ex_4_s, ex_4_f), \
+            ex_4_p
+
+    ex_4_d = Discriminator([
+        payload_shape(message["payload"], ex_4_f)
+        for message in ex_4_f["components"]["messages"].values()])
+    assert ex_4_d.candidates(
+        {"action": "action3", "kind": "a", "field0": 1}) == [3]
+    assert ex_4_d.candidates("ok") == [20, 21]
+    assert ex_4_d.candidates("text") == [20]
+    assert ex_4_d.candidates(42) == []
+
+    # a oneOf referencing itself is unconstrained (and compiles)
+    ex_4_r = {"components": {"schemas": {"loop": {"oneOf": [
+        {"$ref": "#/components/schemas/loop"}, {"type": "string"}]}}}}
+    assert payload_shape({"$ref": "#/components/schemas/loop"}, ex_4_r) \
+        is None
+    compile_payload({"$ref": "#/components/schemas/loop"}, ex_4_r)
+
+    # Classifier assertions (a superset of the valid messages):
+
+    ex_5_c = compile_classifier(ex_4_s, ex_4_f)
+    for ex_4_p in ex_4_payloads:
+        assert set(ex_4_v(ex_4_p)) <= set(ex_5_c(ex_4_p)), ex_4_p
+    assert ex_5_c("ok") == ["Text", "Status"]
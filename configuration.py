@@ -0,0 +1,379 @@
+import hashlib
+import logging
+import os
+import pickle
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Set
+
+import yaml
+
+from command import invalid_commands, referenced_examples, \
+    referenced_generated
+from compiler import MessageValidator, PayloadValidator, \
+    compile_channels, compile_classifiers
+from events import DispatchIndex
+from examples import Example, ExampleCache
+from generator import GeneratedPool, GeneratedPools
+from registry import channel_key
+from wire import ChannelCodec, compile_codecs
+
+try:
+    from yaml import CLoader as Loader
+except ImportError:
+    # PyYAML built without libyaml
+    from yaml import Loader
+
+log = logging.getLogger(__name__)
+
+# changed whenever the content of the cache changes
+CACHE_VERSION = 2
+
+# sections of the specification compared (and recompiled) by their nodes
+TRACKED_SECTIONS = ("channels", "components")
+
+
+def load_yaml(content: bytes) -> Any:
+    return yaml.load(content, Loader=Loader)
+
+
+class Configuration:
+    """Parsed and compiled specification and events files."""
+
+    def __init__(self, key: str, specification: Dict, events: Dict,
+                 dispatch: DispatchIndex,
+                 validators: Dict[str, Dict[str, MessageValidator]],
+                 classifiers: Dict[str, Dict[str, MessageValidator]],
+                 codecs: Dict[str, Dict[str, ChannelCodec]],
+                 examples: ExampleCache, invalid_examples: List[Example],
+                 generated: GeneratedPools, invalid_pools: List[GeneratedPool],
+                 references: Dict[str, PayloadValidator],
+                 dependencies: Dict[str, Set[str]]):
+        # hash of the content of the configuration files
+        self.key = key
+        self.specification = specification
+        self.events = events
+        self.dispatch = dispatch
+        self.validators = validators
+        self.classifiers = classifiers
+        self.codecs = codecs
+        self.examples = examples
+        # referenced examples which are not valid for their channel
+        self.invalid_examples = invalid_examples
+        self.generated = generated
+        # referenced pools with generated payloads not valid for their channel
+        self.invalid_pools = invalid_pools
+        # compiled validators of referenced payloads
+        self.references = references
+        # channels and components (nodes) referenced by each node
+        self.dependencies = dependencies
+        # channel names by their WebSocket paths, shared by all connections
+        self.paths: Dict[str, str] = {
+            os.path.join("/", channel_name): channel_name
+            for channel_name in specification["channels"].keys()}
+
+    @property
+    def channels(self) -> List[str]:
+        return list(self.paths.keys())
+
+
+class ConfigurationCache:
+    """Parsed configuration, dispatch index and encoded examples stored
+    on disk under a hash of the content of the configuration files.
+    Validators are closures, so they are compiled again on every start."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    @staticmethod
+    def key(specification_content: bytes, events_content: bytes) -> str:
+        digest = hashlib.sha256()
+        digest.update(f"{CACHE_VERSION} {sys.version_info[:2]}\0".encode())
+        digest.update(specification_content)
+        digest.update(b"\0")
+        digest.update(events_content)
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pickle")
+
+    def load(self, key: str) -> Optional[Dict]:
+        try:
+            with open(self._path(key), "rb") as cache_file:
+                return pickle.load(cache_file)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log.warning(f"Could not load configuration cache "
+                        f"{self._path(key)}: {e}")
+            return None
+
+    def store(self, key: str, cached: Dict) -> None:
+        temporary_path = None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # written under a temporary name, so that a concurrently
+            # starting server never reads a partial file
+            descriptor, temporary_path = tempfile.mkstemp(
+                dir=self.directory, suffix=".tmp")
+            with os.fdopen(descriptor, "wb") as cache_file:
+                pickle.dump(cached, cache_file, pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary_path, self._path(key))
+            log.debug(f"Stored configuration cache {self._path(key)}")
+        except Exception as e:
+            log.warning(f"Could not store configuration cache "
+                        f"in {self.directory}: {e}")
+            if temporary_path is not None and os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+
+def _node_of(reference: str) -> str:
+    """:return: node (a channel or a component) containing the referenced
+    part of the specification, e.g. "#/components/schemas/user"
+    for "#/components/schemas/user/properties/name"
+    """
+    parts = reference.split("/")
+    return "/".join(parts[:4] if len(parts) > 1 and parts[1] == "components"
+                    else parts[:3])
+
+
+def _nodes(specification: Dict) -> Dict[str, Any]:
+    """:return: channels and components of the specification by their node"""
+    nodes = {f"#/channels/{channel_name}": channel for channel_name, channel
+             in specification["channels"].items()}
+    for kind, components in specification.get("components", {}).items():
+        if isinstance(components, dict):
+            for name, component in components.items():
+                nodes[f"#/components/{kind}/{name}"] = component
+    return nodes
+
+
+def _references(node: Any) -> Set[str]:
+    """:return: nodes referenced directly from a part of the specification"""
+    references = set()
+    stack = [node]
+    while len(stack) > 0:
+        current = stack.pop()
+        if isinstance(current, dict):
+            reference = current.get("$ref")
+            if isinstance(reference, str):
+                references.add(_node_of(reference))
+            stack.extend(current.values())
+        elif isinstance(current, list):
+            stack.extend(current)
+    return references
+
+
+def _changed_nodes(previous: Dict, specification: Dict) -> Optional[Set[str]]:
+    """:return: changed (incl. added and removed) nodes, None when a part
+    of the specification outside of channels and components changed"""
+    for section in set(previous.keys()) | set(specification.keys()):
+        if section not in TRACKED_SECTIONS \
+                and previous.get(section) != specification.get(section):
+            return None
+
+    previous_nodes = _nodes(previous)
+    nodes = _nodes(specification)
+    return {node for node in set(previous_nodes.keys()) | set(nodes.keys())
+            if node not in previous_nodes or node not in nodes
+            or previous_nodes[node] != nodes[node]}
+
+
+def _dependents(dependencies: Dict[str, Set[str]],
+                changed: Set[str]) -> Set[str]:
+    """:return: the changed nodes and all nodes referencing them
+    (directly or indirectly)"""
+    referenced_by = {}
+    for node, references in dependencies.items():
+        for reference in references:
+            referenced_by.setdefault(reference, []).append(node)
+
+    dependents = set(changed)
+    stack = list(changed)
+    while len(stack) > 0:
+        for node in referenced_by.get(stack.pop(), ()):
+            if node not in dependents:
+                dependents.add(node)
+                stack.append(node)
+    return dependents
+
+
+def load_configuration(specification_file: str, events_file: str,
+                       cache_directory: Optional[str] = None,
+                       previous: Optional[Configuration] = None
+                       ) -> Configuration:
+    """Loads the configuration files (from the cache when they have
+    not changed), compiles validators and preloads referenced examples
+    and pools of generated payloads.
+    :param previous: configuration loaded before (e.g. when reloading) -
+    only channels affected by changed channels and components
+    are compiled again, the rest is reused
+    :return: the previous configuration when the files have not changed
+    """
+    start = time.perf_counter()
+
+    with open(specification_file, "rb") as file:
+        specification_content = file.read()
+    with open(events_file, "rb") as file:
+        events_content = file.read()
+
+    key = ConfigurationCache.key(specification_content, events_content)
+    if previous is not None and previous.key == key:
+        return previous
+
+    cache = ConfigurationCache(cache_directory) \
+        if cache_directory is not None else None
+    cached = cache.load(key) if cache is not None else None
+
+    if cached is not None:
+        log.info(f"Loaded configuration from cache {cache.directory}")
+        specification = cached["specification"]
+        events = cached["events"]
+    else:
+        specification = load_yaml(specification_content)
+        events = load_yaml(events_content)
+
+    invalid = invalid_commands(events)
+    if len(invalid) > 0:
+        raise ValueError(f"Invalid events file {events_file}: "
+                         f"{'; '.join(invalid)}")
+
+    # nodes to compile again, None for everything
+    dirty = None
+    if previous is not None:
+        changed = _changed_nodes(previous.specification, specification)
+        if changed is not None:
+            dependencies = dict(previous.dependencies)
+            nodes = _nodes(specification)
+            for node in changed:
+                if node in nodes:
+                    dependencies[node] = _references(nodes[node])
+                else:
+                    dependencies.pop(node, None)
+            dirty = _dependents(dependencies, changed)
+
+    if cached is not None:
+        dependencies = cached["dependencies"]
+        dispatch = cached["dispatch"]
+    else:
+        if dirty is None:
+            dependencies = {node: _references(value) for node, value
+                            in _nodes(specification).items()}
+        dispatch = previous.dispatch \
+            if previous is not None and previous.events == events \
+            else DispatchIndex(events)
+
+    if dirty is None:
+        channels = list(specification["channels"].keys())
+        references = {}
+        validators = {}
+        classifiers = {}
+        codecs = {}
+    else:
+        channels = [channel_name for channel_name
+                    in specification["channels"].keys()
+                    if f"#/channels/{channel_name}" in dirty]
+        references = {reference: validator for reference, validator
+                      in previous.references.items()
+                      if _node_of(reference) not in dirty}
+        validators = {channel_name: previous.validators[channel_name]
+                      for channel_name in specification["channels"].keys()
+                      if channel_name not in channels}
+        classifiers = {channel_name: previous.classifiers[channel_name]
+                       for channel_name in validators.keys()}
+        codecs = {channel_name: previous.codecs[channel_name]
+                  for channel_name in validators.keys()}
+        log.info(f"Recompiling {len(channels)} changed channels: {channels}")
+
+    validators.update(compile_channels(specification, channels, references))
+    log.info(f"Compiled message validators for {len(channels)} channels")
+    classifiers.update(compile_classifiers(specification, channels))
+    codecs.update(compile_codecs(specification, channels=channels))
+
+    examples = ExampleCache(specification, validators, codecs)
+    if cached is not None:
+        examples.restore(cached["examples"])
+    elif dirty is not None:
+        dirty_channels = {channel_key(node[len("#/channels/"):])
+                          for node in dirty if node.startswith("#/channels/")}
+        examples.restore(
+            example for example in previous.examples.compiled()
+            if channel_key(example.channel) not in dirty_channels
+            and _node_of(example.example_ref) not in dirty)
+    invalid_examples = examples.preload(referenced_examples(events))
+    # generating is cheaper than loading the pools from the cache
+    generated = GeneratedPools(specification, validators, codecs)
+    if dirty is not None:
+        kept_channels = {channel_key(channel_name) for channel_name
+                         in validators.keys() if channel_name not in channels}
+        generated.restore(
+            (reference, pool) for reference, pool
+            in previous.generated.compiled()
+            if reference[0] in kept_channels
+            and _node_of(reference[1]) not in dirty)
+    invalid_pools = generated.preload(referenced_generated(events))
+
+    if cache is not None and cached is None:
+        cache.store(key, {
+            "specification": specification,
+            "events": events,
+            "dispatch": dispatch,
+            "dependencies": dependencies,
+            "examples": examples.compiled(),
+        })
+
+    log.debug(f"Configuration loaded in {time.perf_counter() - start:.3f} s")
+    return Configuration(key, specification, events, dispatch, validators,
+                         classifiers, codecs, examples, invalid_examples,
+                         generated, invalid_pools, references, dependencies)
+
+
+if __name__ == '__main__':
+    import copy
+
+    # Incremental change detection assertions:
+
+    assert _node_of("#/components/schemas/user/properties/name") == \
+        "#/components/schemas/user"
+    assert _node_of("#/channels/chat/publish") == "#/channels/chat"
+
+    ex_1_s = {
+        "info": {"title": "Example"},
+        "channels": {
+            "chat": {"publish": {"message": {
+                "$ref": "#/components/messages/text"}}},
+            "users": {"publish": {"message": {
+                "$ref": "#/components/messages/user"}}},
+        },
+        "components": {
+            "messages": {
+                "text": {"name": "Text", "payload": {"type": "string"}},
+                "user": {"name": "User", "payload": {
+                    "$ref": "#/components/schemas/user"}},
+            },
+            "schemas": {
+                "user": {"type": "object", "properties": {
+                    "name": {"$ref": "#/components/schemas/name"}}},
+                "name": {"type": "string"},
+            },
+        },
+    }
+    ex_1_d = {node: _references(value)
+              for node, value in _nodes(ex_1_s).items()}
+    assert ex_1_d["#/components/schemas/user"] == {"#/components/schemas/name"}
+
+    ex_2_s = copy.deepcopy(ex_1_s)
+    ex_2_s["components"]["schemas"]["name"]["maxLength"] = 10
+    ex_2_c = _changed_nodes(ex_1_s, ex_2_s)
+    assert ex_2_c == {"#/components/schemas/name"}
+    assert "#/channels/users" in _dependents(ex_1_d, ex_2_c)
+    assert "#/channels/chat" not in _dependents(ex_1_d, ex_2_c)
+
+    ex_3_s = copy.deepcopy(ex_1_s)
+    ex_3_s["channels"]["news"] = ex_3_s["channels"]["chat"]
+    assert _changed_nodes(ex_1_s, ex_3_s) == {"#/channels/news"}
+
+    ex_4_s = copy.deepcopy(ex_1_s)
+    ex_4_s["defaultContentType"] = "application/json"
+    assert _changed_nodes(ex_1_s, ex_4_s) is None
@@ -0,0 +1,198 @@
+import logging
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence, Set, \
+    Tuple
+
+from message import dereference
+
+log = logging.getLogger(__name__)
+
+# JSON types of decoded payloads accepted by each specification type
+# (the same isinstance checks as in `message.validate_payload`)
+_TYPE_CLASSES = {
+    "string": frozenset([str]),
+    "integer": frozenset([int, bool]),
+    "number": frozenset([float]),
+    "object": frozenset([dict]),
+}
+_JSON_CLASSES = (str, int, bool, float, dict)
+
+
+class Shape:
+    """What a payload has to look like to possibly pass a specification.
+    Only necessary conditions are kept - a payload matching a shape
+    still has to be validated."""
+
+    def __init__(self, classes: FrozenSet[type],
+                 properties: FrozenSet[str] = frozenset(),
+                 property_enums: Dict[str, FrozenSet] = None,
+                 values: Optional[FrozenSet] = None):
+        self.classes = classes
+        # property names every valid (object) payload contains
+        self.properties = properties
+        # hashable enum values of properties
+        self.property_enums = property_enums or {}
+        # hashable enum values of the payload itself
+        self.values = values
+
+
+def _hashable_enum(payload_specification: Dict) -> Optional[FrozenSet]:
+    if "enum" not in payload_specification:
+        return None
+    try:
+        return frozenset(payload_specification["enum"])
+    except TypeError:
+        return None
+
+
+def _resolve(payload_specification: Dict, full_specification: Dict,
+             seen: Set[str]) -> Tuple[Optional[Dict], Set[str]]:
+    """:return: the specification with its `$ref`s resolved (None for
+    a cycle of references) and the references resolved so far"""
+    while "type" not in payload_specification \
+            and "$ref" in payload_specification:
+        reference = payload_specification["$ref"]
+        if reference in seen:
+            return None, seen
+        seen = seen | {reference}
+        payload_specification = dereference(reference, full_specification)
+    return payload_specification, seen
+
+
+def payload_shape(payload_specification: Dict, full_specification: Dict,
+                  seen: Set[str] = frozenset()) -> Optional[Shape]:
+    """:return: shape of valid payloads or None if any payload
+    can possibly pass (or fail only when it is being validated)"""
+    payload_specification, seen = _resolve(payload_specification,
+                                           full_specification, seen)
+    if payload_specification is None:
+        return None
+
+    if "type" not in payload_specification:
+        if "oneOf" not in payload_specification:
+            return None
+
+        shapes = [payload_shape(spec, full_specification, seen)
+                  for spec in payload_specification["oneOf"]]
+        if any(shape is None for shape in shapes):
+            return None
+        classes = frozenset().union(*[shape.classes for shape in shapes])
+        if dict not in classes:
+            return Shape(classes)
+        # only properties required by every alternative are certain
+        properties = frozenset.intersection(*[shape.properties
+                                              for shape in shapes
+                                              if dict in shape.classes])
+        return Shape(classes, properties)
+
+    classes = _TYPE_CLASSES.get(payload_specification["type"])
+    if classes is None:
+        # unsupported type - the validator raises NotImplementedError
+        return None
+
+    values = _hashable_enum(payload_specification)
+
+    if payload_specification["type"] != "object":
+        return Shape(classes, values=values)
+
+    if "properties" not in payload_specification:
+        # no payload passes
+        return Shape(frozenset())
+
+    property_enums = {}
+    for prop, prop_specification in \
+            payload_specification["properties"].items():
+        prop_specification, _ = _resolve(prop_specification,
+                                         full_specification, seen)
+        enum_values = _hashable_enum(prop_specification) \
+            if prop_specification is not None else None
+        if enum_values is not None:
+            property_enums[prop] = enum_values
+
+    return Shape(classes, frozenset(payload_specification["properties"]),
+                 property_enums, values)
+
+
+class Discriminator:
+    """Picks the alternatives of a oneOf a payload could match,
+    by the JSON type of the payload, required property names
+    and enum values of a property shared by the object alternatives."""
+
+    def __init__(self, shapes: Sequence[Optional[Shape]]):
+        self.shapes = tuple(shapes)
+        every = range(len(self.shapes))
+
+        def accepting(cls: type) -> List[int]:
+            return [i for i in every if self.shapes[i] is None
+                    or cls in self.shapes[i].classes]
+
+        self.any = accepting(None)
+        self.by_class = {cls: accepting(cls) for cls in _JSON_CLASSES}
+        self.check_values = any(shape is not None and shape.values is not None
+                                for shape in self.shapes)
+
+        # property with the most object alternatives constraining it by enum
+        objects = [i for i in self.by_class[dict]
+                   if self.shapes[i] is not None]
+        enum_counts = {}
+        for i in objects:
+            for prop in self.shapes[i].property_enums:
+                enum_counts[prop] = enum_counts.get(prop, 0) + 1
+
+        self.property = None
+        if len(enum_counts) > 0:
+            prop, count = max(enum_counts.items(), key=lambda item: item[1])
+            if count > 1:
+                self.property = prop
+
+        if self.property is not None:
+            constrained = [i for i in objects if self.property
+                           in self.shapes[i].property_enums]
+            unconstrained = [i for i in self.by_class[dict]
+                             if i not in constrained]
+            self.by_property_value = {}
+            for i in constrained:
+                for value in self.shapes[i].property_enums[self.property]:
+                    self.by_property_value.setdefault(
+                        value, list(unconstrained)).append(i)
+            for value, candidates in self.by_property_value.items():
+                candidates.sort()
+            self.unknown_property_value = unconstrained
+            self.without_property = [
+                i for i in self.by_class[dict] if self.shapes[i] is None
+                or self.property not in self.shapes[i].properties]
+
+        log.debug(f"Discriminator over {len(self.shapes)} alternatives "
+                  f"(enum property: {self.property})")
+
+    def candidates(self, payload: Any) -> List[int]:
+        """:return: indices of the alternatives the payload could match
+        (in the order of the oneOf)"""
+        cls = payload.__class__
+        candidates = self.by_class.get(cls, self.any)
+
+        if cls is dict:
+            if self.property is not None:
+                try:
+                    candidates = self.by_property_value.get(
+                        payload[self.property], self.unknown_property_value)
+                except KeyError:
+                    candidates = self.without_property
+                except TypeError:
+                    # unhashable property value - keep all object candidates
+                    pass
+
+            keys = payload.keys()
+            shapes = self.shapes
+            return [i for i in candidates if shapes[i] is None
+                    or shapes[i].properties <= keys]
+
+        if self.check_values:
+            shapes = self.shapes
+            try:
+                return [i for i in candidates if shapes[i] is None
+                        or shapes[i].values is None
+                        or payload in shapes[i].values]
+            except TypeError:
+                return candidates
+
+        return candidates
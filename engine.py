@@ -0,0 +1,264 @@
+import asyncio
+import logging
+import signal
+import socket
+from collections import OrderedDict
+from typing import Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+from channel import ChannelConnection
+from metrics import CONTENT_TYPE
+from outbound import PreparedFrame, SendQueue
+from profiling import Profiler
+from reload import ConfigurationReloader
+from scheduler import Scheduler
+from stats import report
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+try:
+    import websockets
+    from websockets.asyncio.server import serve as websockets_serve
+    from websockets.exceptions import ConnectionClosed
+    from websockets.protocol import State
+except ImportError:
+    websockets = None
+
+log = logging.getLogger(__name__)
+
+
+class Engines:
+    GEVENT = "gevent"
+    ASYNCIO = "asyncio"
+
+    ALL = [GEVENT, ASYNCIO]
+
+
+class AsyncioScheduler(Scheduler):
+    """Scheduler driven by a task of the asyncio event loop."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._wakeup = asyncio.Event()
+
+    def start(self) -> None:
+        self._driver = asyncio.get_event_loop().create_task(self._drive())
+
+    async def _drive(self):
+        while True:
+            try:
+                delay = self.step()
+            except SystemExit as e:
+                _exit_soon(e)
+                return
+            if delay == 0:
+                # let the connections run between consecutive batches
+                await asyncio.sleep(0)
+                continue
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+
+class AsyncioProfiler(Profiler):
+    """Profiler of the asyncio engine - the heartbeat is a task and the time
+    of tasks is not measured separately (there are no greenlets)."""
+
+    def _trace_switches(self) -> None:
+        pass
+
+    def _spawn_heartbeat(self) -> None:
+        asyncio.get_event_loop().create_task(self._heartbeat())
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self._beat_interval)
+            self._beat_step()
+
+    def _on_signal(self, signum: int, handler) -> None:
+        asyncio.get_event_loop().add_signal_handler(signum, handler)
+
+
+class AsyncioSendQueue(SendQueue):
+    """Send queue of a websockets connection drained by its own task."""
+    __slots__ = ()
+
+    def _spawn(self):
+        return asyncio.get_event_loop().create_task(self._drain())
+
+    async def _drain(self):
+        connection = self.ws
+        queue = self._queue
+        try:
+            while len(queue) > 0:
+                message = queue.popleft()
+                try:
+                    if isinstance(message, PreparedFrame):
+                        # written to the transport like websockets.broadcast
+                        # does, waiting only when the client does not keep up
+                        if connection.state is not State.OPEN:
+                            raise ConnectionError("Connection is closed")
+                        connection.transport.write(message.data)
+                        await connection.drain()
+                    else:
+                        await connection.send(message)
+                    self.sent += 1
+                except (ConnectionClosed, ConnectionError):
+                    log.debug(f"Client {self.name} is gone, "
+                              f"dropping {len(queue)} queued messages")
+                    self.closed = True
+                    return
+        finally:
+            self._drained()
+
+    def disconnect(self):
+        log.warning(f"Disconnecting client {self.name} "
+                    f"with a full send queue")
+        self.close()
+        # a close frame would wait for a client which does not read anymore
+        self.ws.transport.abort()
+
+    def close(self):
+        self.closed = True
+        self._queue = None
+        if self._writer is not None:
+            self._writer.cancel()
+
+
+class AsyncioServer:
+    """Mock server of the asyncio engine (websockets, on uvloop when it is
+    installed). Connections and command chains are handled by the same
+    code as in the gevent engine, see `command.MockedWebSocketServer`
+    for the attributes."""
+
+    def __init__(self, listener: Union[Tuple[str, int], socket.socket],
+                 routes: OrderedDict):
+        if websockets is None:
+            raise NotImplementedError(f"Engine {Engines.ASYNCIO} requires "
+                                      f"the websockets package")
+        if isinstance(listener, tuple):
+            self.address = listener
+            self._listen = {"host": listener[0], "port": listener[1]}
+        else:
+            self.address = listener.getsockname()[:2]
+            # created by gevent
+            self._listen = {"sock": socket.socket(fileno=listener.detach())}
+        self.routes = routes
+        if not log.isEnabledFor(logging.DEBUG):
+            # every connection would be logged
+            logging.getLogger("websockets").setLevel(logging.WARNING)
+        self.loop = uvloop.new_event_loop() if uvloop is not None \
+            else asyncio.new_event_loop()
+        # tasks of the server (scheduler, send queues) are created
+        # before the loop runs
+        asyncio.set_event_loop(self.loop)
+
+    def _process_request(self, connection, request):
+        path = urlsplit(request.path).path
+        if self.args.metrics and path == "/metrics":
+            return self._metrics_response(connection, request)
+        if path not in self.routes:
+            return connection.respond(404, "Not Found\n")
+        return None
+
+    def _metrics_response(self, connection, request):
+        response = connection.respond(200, self.metrics.render())
+        response.headers["Content-Type"] = CONTENT_TYPE
+        return response
+
+    async def _handle(self, connection) -> None:
+        path = urlsplit(connection.request.path)
+        client = ChannelConnection(self, path.path, path.query)
+        client.opened(AsyncioSendQueue(
+            connection, str(connection.remote_address),
+            self.args.send_queue_size, self.args.send_queue_policy))
+        try:
+            async for message in connection:
+                client.received(message)
+        except ConnectionClosed:
+            pass
+        except SystemExit as e:
+            _exit_soon(e)
+        finally:
+            client.closed()
+
+    async def _serve(self) -> None:
+        host, port = self.address
+        options = {
+            # the same as gevent-websocket - no compression, no pings
+            # and no limit of the message size
+            "compression": None,
+            "ping_interval": None,
+            "max_size": None,
+        }
+
+        reloader = ConfigurationReloader(self)
+        self.loop.add_signal_handler(signal.SIGHUP, reloader.reload)
+        if self.args.reload_interval > 0:
+            self.loop.create_task(_periodically(reloader.check,
+                                                self.args.reload_interval))
+        if self.args.stats_interval > 0:
+            self.loop.create_task(_periodically(lambda: report(self),
+                                                self.args.stats_interval))
+
+        if self.args.metrics:
+            log.info(f"Serving metrics at {host}:{port}/metrics")
+        if self.args.metrics_port is not None:
+            await websockets_serve(None, host, self.args.metrics_port,
+                                   process_request=self._metrics_response,
+                                   **options)
+            log.info(f"Serving metrics at {host}:{self.args.metrics_port}")
+
+        server = await websockets_serve(
+            self._handle, process_request=self._process_request,
+            **self._listen, **options)
+        log.info(f"Started AsyncApi-WebSocket-Mock server at {host}:{port} "
+                 f"(engine {Engines.ASYNCIO}"
+                 f"{', uvloop' if uvloop is not None else ''})")
+        await server.serve_forever()
+
+    def serve_forever(self) -> None:
+        try:
+            self.loop.run_until_complete(self._serve())
+        except KeyboardInterrupt:
+            pass
+
+
+def _exit_soon(e: SystemExit) -> None:
+    """Exits from the event loop instead of a task (e.g. because of
+    --strict) - SystemExit raised by a task is reported by the loop
+    as an exception which was never retrieved."""
+    def exit_loop():
+        raise e
+
+    asyncio.get_event_loop().call_soon(exit_loop)
+
+
+async def _periodically(function, interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        function()
+
+
+def missing_package(engine: str) -> Optional[str]:
+    """:return: name of a package the engine requires which is not
+    installed, None when it can be used"""
+    if engine == Engines.ASYNCIO and websockets is None:
+        return "websockets"
+    return None
+
+
+def unsupported_arguments(args) -> Optional[str]:
+    """:return: description of arguments the asyncio engine does not
+    support (yet), None when all of them are supported"""
+    if args.workers > 1:
+        return "--workers"
+    if args.validation_workers > 0:
+        return "--validation-workers"
+    return None
@@ -1,3 +1,96 @@
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from registry import channel_key
+
+log = logging.getLogger(__name__)
+
 
 class EventTypes:
     MESSAGE_RECEIVED = "message_received"
+
+
+class Event:
+    """A configured event of the events file."""
+
+    def __init__(self, name: str, position: int, channel: str, when: str,
+                 message_name: Optional[str], commands: List[Dict]):
+        self.name = name
+        # order of the event in the events file
+        self.position = position
+        self.channel = channel
+        self.when = when
+        self.message_name = message_name
+        self.commands = commands
+
+
+class DispatchIndex:
+    """Events indexed by (channel, event type, message name)."""
+
+    def __init__(self, events: Dict):
+        self._events: Dict[Tuple[str, str, Optional[str]], List[Event]] = {}
+
+        for position, (event_name, event) in enumerate(
+                events["events"].items()):
+            indexed_event = Event(event_name, position, event["channel"],
+                                  event["when"], event.get("message_name"),
+                                  event["do"])
+            key = (channel_key(indexed_event.channel), indexed_event.when,
+                   indexed_event.message_name)
+            self._events.setdefault(key, []).append(indexed_event)
+
+        log.debug(f"Indexed {len(events['events'])} events "
+                  f"under {len(self._events)} keys")
+
+    def lookup(self, channel: str, event_type: str,
+               message_names: List[str]) -> List[Event]:
+        """:return: events triggered by any of the message names
+        (each event once, in the order of the events file)"""
+        channel = channel_key(channel)
+
+        if len(message_names) == 1:
+            return self._events.get((channel, event_type, message_names[0]),
+                                    [])
+
+        out = {}
+        for message_name in message_names:
+            for event in self._events.get((channel, event_type, message_name),
+                                          ()):
+                out[event.position] = event
+        return [out[position] for position in sorted(out)]
+
+
+if __name__ == '__main__':
+    # Dispatch index assertions:
+
+    ex_1_i = DispatchIndex({"events": {
+        "image": {"when": "message_received", "channel": "/chat/",
+                  "message_name": "Image", "do": []},
+        "text": {"when": "message_received", "channel": "chat",
+                 "message_name": "Text", "do": []},
+        "any": {"when": "message_received", "channel": "chat", "do": []},
+        "text_again": {"when": "message_received", "channel": "chat",
+                       "message_name": "Text", "do": []},
+        "news": {"when": "message_received", "channel": "news",
+                 "message_name": "Text", "do": []},
+    }})
+
+    def ex_1_names(events):
+        return [event.name for event in events]
+
+    # multiple message names - the order of the events file, each event once
+    assert ex_1_names(ex_1_i.lookup("chat", EventTypes.MESSAGE_RECEIVED,
+                                    ["Text", "Image", "Text"])) \
+        == ["image", "text", "text_again"]
+    assert ex_1_names(ex_1_i.lookup("chat", EventTypes.MESSAGE_RECEIVED,
+                                    ["Text"])) == ["text", "text_again"]
+    # channel names and WebSocket paths are the same channel
+    assert ex_1_names(ex_1_i.lookup("/chat", EventTypes.MESSAGE_RECEIVED,
+                                    ["Image"])) == ["image"]
+    assert ex_1_names(ex_1_i.lookup("/news/", EventTypes.MESSAGE_RECEIVED,
+                                    ["Text"])) == ["news"]
+    # events without a message name are not triggered by any message
+    assert ex_1_i.lookup("chat", EventTypes.MESSAGE_RECEIVED, []) == []
+    assert "any" not in ex_1_names(ex_1_i.lookup(
+        "chat", EventTypes.MESSAGE_RECEIVED, ["Text", "Image"]))
+    assert ex_1_i.lookup("chat", "unknown", ["Text"]) == []
@@ -0,0 +1,99 @@
+import logging
+from typing import Any, Dict, Iterable, List, Tuple
+
+from compiler import MessageValidator
+from message import dereference
+from outbound import PreparedFrame
+from registry import channel_key
+from wire import ChannelCodec, Frame
+
+log = logging.getLogger(__name__)
+
+
+class Example:
+    """An example message resolved, validated and encoded for sending."""
+
+    def __init__(self, channel: str, example_ref: str, data: Any,
+                 encoded: Frame, messages: List[str]):
+        self.channel = channel
+        self.example_ref = example_ref
+        self.data = data
+        self.encoded = encoded
+        # WebSocket frame shared by all recipients of broadcasts
+        self.frame = PreparedFrame(encoded)
+        # names of the subscribe messages the example is valid for
+        self.messages = messages
+
+    @property
+    def is_valid(self) -> bool:
+        return len(self.messages) > 0
+
+    def __getstate__(self) -> Dict:
+        # the frame is a memoryview, which cannot be pickled
+        state = dict(self.__dict__)
+        del state["frame"]
+        return state
+
+    def __setstate__(self, state: Dict) -> None:
+        self.__dict__.update(state)
+        self.frame = PreparedFrame(self.encoded)
+
+
+class ExampleCache:
+    """Examples are resolved, validated against the subscribe message
+    specification of their channel and encoded (by the codec of the message
+    they are valid for) only once (on preload or on first use)."""
+
+    def __init__(self, specification: Dict,
+                 validators: Dict[str, Dict[str, MessageValidator]],
+                 codecs: Dict[str, Dict[str, ChannelCodec]]):
+        self.specification = specification
+        self.validators = validators
+        self.codecs = codecs
+        self._examples: Dict[Tuple[str, str], Example] = {}
+
+    def _compile(self, channel: str, example_ref: str) -> Example:
+        example_data = dereference(example_ref, self.specification)["value"]
+        messages = self.validators[channel]["subscribe"](example_data)
+
+        if len(messages) == 0:
+            log.error(f"Provided example {example_ref} is not valid "
+                      f"in any subscribe message specification "
+                      f"for channel {channel}")
+        else:
+            log.debug(f"Example {example_ref} is valid for channel {channel} "
+                      f"as {messages}")
+
+        codec = self.codecs[channel]["subscribe"].encoder(messages)
+        return Example(channel, example_ref, example_data,
+                       codec.encode(example_data), messages)
+
+    def get(self, channel: str, example_ref: str) -> Example:
+        key = (channel_key(channel), example_ref)
+        example = self._examples.get(key)
+        if example is None:
+            example = self._compile(channel, example_ref)
+            self._examples[key] = example
+        return example
+
+    def compiled(self) -> List[Example]:
+        return list(self._examples.values())
+
+    def restore(self, examples: Iterable[Example]) -> None:
+        """Adds examples compiled earlier (e.g. loaded from a cache)."""
+        for example in examples:
+            self._examples[(channel_key(example.channel),
+                            example.example_ref)] = example
+
+    def preload(self, references: Iterable[Tuple[str, str]]) -> List[Example]:
+        """Compiles all referenced examples in advance.
+        :param references: pairs of (channel, example_ref)
+        :return: examples which are not valid for their channel
+        """
+        invalid = []
+        for channel, example_ref in references:
+            example = self.get(channel, example_ref)
+            if not example.is_valid and example not in invalid:
+                invalid.append(example)
+        log.debug(f"Preloaded {len(self._examples)} examples")
+        return invalid
@@ -0,0 +1,63 @@
+import logging
+from collections import OrderedDict
+from typing import Hashable, List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+# bigger frames are not cached, so that a few of them do not hold
+# the memory of the whole cache
+MAX_CACHED_FRAME = 64 * 1024
+
+
+class FrameCache:
+    """Size-bounded LRU cache of names of the messages received frames
+    were classified as, keyed by (channel, raw frame). Decoded payloads are
+    not kept - nothing after the validation needs them."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._entries: "OrderedDict[Tuple[str, Hashable], List[str]]" = \
+            OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def key(channel: str, frame) -> Optional[Tuple[str, Hashable]]:
+        """:return: key of the frame, None when it is not to be cached"""
+        if len(frame) > MAX_CACHED_FRAME:
+            return None
+        # binary frames are received as (unhashable) bytearrays
+        return channel, frame if isinstance(frame, str) else bytes(frame)
+
+    def get(self, key: Tuple[str, Hashable]) -> Optional[List[str]]:
+        messages = self._entries.get(key)
+        if messages is not None:
+            self._entries.move_to_end(key)
+        return messages
+
+    def put(self, key: Tuple[str, Hashable], messages: List[str]) -> bool:
+        """:return: True when the least recently used entry was evicted"""
+        self._entries[key] = messages
+        if len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+            return True
+        return False
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+if __name__ == '__main__':
+    # LRU assertions:
+
+    ex_1_c = FrameCache(2)
+    ex_1_a = FrameCache.key("chat", '"a"')
+    ex_1_b = FrameCache.key("chat", bytearray(b"\x01"))
+    ex_1_d = FrameCache.key("chat", '"d"')
+    assert not ex_1_c.put(ex_1_a, ["Text"])
+    assert not ex_1_c.put(ex_1_b, [])
+    assert ex_1_c.get(ex_1_a) == ["Text"]
+    assert ex_1_c.put(ex_1_d, ["Text"])
+    assert ex_1_c.get(ex_1_b) is None and len(ex_1_c) == 2
+    assert FrameCache.key("chat", "x" * (MAX_CACHED_FRAME + 1)) is None
@@ -0,0 +1,279 @@
+import logging
+import math
+import random
+import string
+from typing import Any, Dict, Iterable, List, Tuple
+
+from compiler import MessageValidator
+from message import dereference
+from outbound import PreparedFrame
+from registry import channel_key
+from wire import ChannelCodec
+
+log = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 100
+DEFAULT_SEED = 0
+
+# ranges used when the specification does not limit the values
+DEFAULT_MINIMUM = -1000
+DEFAULT_MAXIMUM = 1000
+DEFAULT_MAX_LENGTH = 16
+
+# nesting of objects, oneOfs and $refs - deeper (recursive) specifications
+# are generated only through alternatives which end
+MAX_DEPTH = 16
+
+_CHARACTERS = string.ascii_letters + string.digits + " "
+
+
+class PayloadGenerator:
+    """Generates random payloads valid against payload specifications
+    (of the same types as understood by `message.validate_payload`)."""
+
+    def __init__(self, full_specification: Dict, rng: random.Random):
+        self.full_specification = full_specification
+        self.rng = rng
+
+    def generate(self, payload_specification: Dict, depth: int = 0) -> Any:
+        if depth > MAX_DEPTH:
+            raise ValueError(f"Payload specification {payload_specification} "
+                             f"is nested deeper than {MAX_DEPTH} levels")
+
+        if "type" not in payload_specification:
+            if "$ref" in payload_specification:
+                return self.generate(dereference(payload_specification["$ref"],
+                                                 self.full_specification),
+                                     depth + 1)
+            if "oneOf" in payload_specification:
+                return self._generate_one_of(payload_specification["oneOf"],
+                                             depth)
+            raise NotImplementedError(
+                f"Payload specification {payload_specification} "
+                f"is not yet supported by the generator")
+
+        if "enum" in payload_specification:
+            return self.rng.choice(payload_specification["enum"])
+
+        payload_type = payload_specification["type"]
+        if payload_type == "string":
+            return self._generate_string(payload_specification)
+        if payload_type == "integer":
+            minimum, maximum = self._range(payload_specification)
+            # bounds of integers can be numbers, e.g. `maximum: 1.5`
+            minimum, maximum = math.ceil(minimum), math.floor(maximum)
+            if minimum > maximum:
+                raise ValueError(f"There is no integer between the minimum "
+                                 f"and the maximum of {payload_specification}")
+            return self.rng.randint(minimum, maximum)
+        if payload_type == "number":
+            minimum, maximum = self._range(payload_specification)
+            return float(self.rng.uniform(minimum, maximum))
+        if payload_type == "object":
+            if "properties" not in payload_specification:
+                raise ValueError("Object specification without properties "
+                                 "accepts no payload")
+            return {prop: self.generate(prop_specification, depth + 1)
+                    for prop, prop_specification
+                    in payload_specification["properties"].items()}
+
+        raise NotImplementedError(
+            f"Payload specification {payload_specification} "
+            f"is not yet supported by the generator")
+
+    def _generate_one_of(self, alternatives: List[Dict], depth: int) -> Any:
+        # an alternative which cannot be generated (e.g. too deep) is skipped
+        order = list(range(len(alternatives)))
+        self.rng.shuffle(order)
+        error = None
+        for i in order:
+            try:
+                return self.generate(alternatives[i], depth + 1)
+            except ValueError as e:
+                error = e
+        raise ValueError(f"No alternative of a oneOf can be generated: "
+                         f"{error}")
+
+    def _generate_string(self, payload_specification: Dict) -> str:
+        min_length = payload_specification.get("minLength", 0)
+        max_length = payload_specification.get(
+            "maxLength", max(min_length, DEFAULT_MAX_LENGTH))
+        length = self.rng.randint(min_length, max_length)
+        return "".join(self.rng.choice(_CHARACTERS) for _ in range(length))
+
+    @staticmethod
+    def _range(payload_specification: Dict) -> Tuple[Any, Any]:
+        minimum = payload_specification.get("minimum")
+        maximum = payload_specification.get("maximum")
+        if minimum is None and maximum is None:
+            return DEFAULT_MINIMUM, DEFAULT_MAXIMUM
+        if minimum is None:
+            return maximum - (DEFAULT_MAXIMUM - DEFAULT_MINIMUM), maximum
+        if maximum is None:
+            return minimum, minimum + (DEFAULT_MAXIMUM - DEFAULT_MINIMUM)
+        return minimum, maximum
+
+
+class GeneratedPool:
+    """Payloads of a message generated, validated and encoded in advance.
+    Frames are taken from the pool in a round robin."""
+
+    def __init__(self, message_name: str, frames: List[PreparedFrame],
+                 invalid: int):
+        self.message_name = message_name
+        self.frames = frames
+        # generated payloads which did not pass the validation
+        self.invalid = invalid
+        self._next = 0
+
+    def next(self) -> PreparedFrame:
+        frame = self.frames[self._next]
+        self._next = (self._next + 1) % len(self.frames)
+        return frame
+
+
+class GeneratedPools:
+    """Pools of generated payloads by (channel, message, size, seed),
+    created only once (on preload or on first use)."""
+
+    def __init__(self, specification: Dict,
+                 validators: Dict[str, Dict[str, MessageValidator]],
+                 codecs: Dict[str, Dict[str, ChannelCodec]]):
+        self.specification = specification
+        self.validators = validators
+        self.codecs = codecs
+        self._pools: Dict[Tuple[str, str, int, int], GeneratedPool] = {}
+
+    def _generate(self, channel: str, message_ref: str, size: int,
+                  seed: int) -> GeneratedPool:
+        message_specification = dereference(message_ref, self.specification)
+        message_name = message_specification["name"]
+        generator = PayloadGenerator(self.specification, random.Random(seed))
+        validate = self.validators[channel]["subscribe"]
+        codec = self.codecs[channel]["subscribe"].encoder([message_name])
+
+        frames = []
+        invalid = 0
+        for _ in range(size):
+            payload = generator.generate(message_specification["payload"])
+            if message_name not in validate(payload):
+                invalid += 1
+            frames.append(PreparedFrame(codec.encode(payload)))
+
+        if invalid > 0:
+            log.error(f"{invalid} of {size} payloads generated for message "
+                      f"{message_ref} are not valid subscribe messages "
+                      f"for channel {channel}")
+        else:
+            log.debug(f"Generated {size} payloads of message {message_ref} "
+                      f"for channel {channel}")
+        return GeneratedPool(message_name, frames, invalid)
+
+    def get(self, channel: str, message_ref: str,
+            size: int = DEFAULT_POOL_SIZE,
+            seed: int = DEFAULT_SEED) -> GeneratedPool:
+        key = (channel_key(channel), message_ref, size, seed)
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = self._generate(channel, message_ref, size, seed)
+            self._pools[key] = pool
+        return pool
+
+    def compiled(self) -> List[Tuple[Tuple[str, str, int, int],
+                                     GeneratedPool]]:
+        """:return: pools with their (channel, message_ref, size, seed)"""
+        return list(self._pools.items())
+
+    def restore(self, pools: Iterable[Tuple[Tuple[str, str, int, int],
+                                            GeneratedPool]]) -> None:
+        """Adds pools generated earlier (e.g. before a reload)."""
+        for key, pool in pools:
+            self._pools[key] = pool
+
+    def preload(self, references: Iterable[Tuple[str, str, int, int]]
+                ) -> List[GeneratedPool]:
+        """Generates all referenced pools in advance.
+        :param references: tuples of (channel, message_ref, pool_size, seed)
+        :return: pools with payloads which are not valid for their channel
+        """
+        invalid = []
+        for reference in references:
+            pool = self.get(*reference)
+            if pool.invalid > 0 and pool not in invalid:
+                invalid.append(pool)
+        log.debug(f"Preloaded {len(self._pools)} pools of generated payloads")
+        return invalid
+
+
+if __name__ == '__main__':
+    import os
+
+    from yaml import Loader, load
+
+    from compiler import compile_payload
+
+    # Generated payloads are valid:
+
+    ex_1_f = {"components": {"schemas": {
+        "node": {"oneOf": [
+            {"type": "object", "properties": {
+                "value": {"type": "integer", "minimum": 3, "maximum": 5},
+                "next": {"$ref": "#/components/schemas/node"}}},
+            {"type": "string", "enum": ["end"]},
+        ]},
+    }}}
+    ex_1_s = {"type": "object", "properties": {
+        "head": {"$ref": "#/components/schemas/node"},
+        "ratio": {"type": "number", "maximum": 1},
+        "state": {"type": "string", "enum": ["on", "off"]},
+        "label": {"type": "string", "minLength": 2, "maxLength": 4},
+    }}
+    ex_1_v = compile_payload(ex_1_s, ex_1_f)
+    ex_1_g = PayloadGenerator(ex_1_f, random.Random(1))
+    ex_1_p = [ex_1_g.generate(ex_1_s) for _ in range(200)]
+    assert all(ex_1_v(ex_1_p_i) for ex_1_p_i in ex_1_p)
+    assert len(set(repr(ex_1_p_i) for ex_1_p_i in ex_1_p)) > 100
+
+    # integers between bounds which are not integers
+    ex_1_i = {"type": "integer", "minimum": 0.5, "maximum": 2.5}
+    assert {ex_1_g.generate(ex_1_i) for _ in range(50)} == {1, 2}
+    try:
+        ex_1_g.generate({"type": "integer", "minimum": 1.2, "maximum": 1.8})
+        assert False
+    except ValueError:
+        pass
+
+    # the same seed generates the same payloads
+    ex_2_g = PayloadGenerator(ex_1_f, random.Random(1))
+    assert [ex_2_g.generate(ex_1_s) for _ in range(200)] == ex_1_p
+
+    # Pools of the example specification:
+
+    from compiler import compile_channels
+    from wire import compile_codecs
+
+    with open(os.path.join(os.path.dirname(__file__), "example-config",
+                           "specification.yaml"), "r") as specification_file:
+        ex_3_f = load(specification_file, Loader=Loader)
+    ex_3_p = GeneratedPools(ex_3_f, compile_channels(ex_3_f),
+                            compile_codecs(ex_3_f))
+    ex_3_i = ex_3_p.get("chat", "#/components/messages/image_message", 10)
+    assert ex_3_i.invalid == 0 and len(ex_3_i.frames) == 10
+    assert ex_3_p.get("/chat", "#/components/messages/image_message", 10) \
+        is ex_3_i
+    assert ex_3_i.next() is ex_3_i.frames[0]
+    assert ex_3_i.next() is ex_3_i.frames[1]
+
+    ex_4_p = GeneratedPools(ex_3_f, ex_3_p.validators, ex_3_p.codecs)
+    ex_4_p.restore(ex_3_p.compiled())
+    assert ex_4_p.get("chat", "#/components/messages/image_message", 10) \
+        is ex_3_i
+
+    # pools with payloads not valid for the channel are reported on preload
+    assert ex_4_p.preload([("chat", "#/components/messages/image_message",
+                            10, 0)]) == []
+    ex_5_p = GeneratedPools(ex_3_f, {"chat": {"subscribe": lambda _: []}},
+                            ex_3_p.codecs)
+    ex_5_i = ex_5_p.preload(
+        [("chat", "#/components/messages/image_message", 10, 0)] * 2)
+    assert len(ex_5_i) == 1 and ex_5_i[0].invalid == 10
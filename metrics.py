@@ -0,0 +1,271 @@
+import logging
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from stats import collect
+
+log = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# seconds
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                   0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+SIZE_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+
+def _escape(label_value) -> str:
+    return str(label_value).replace("\\", "\\\\").replace("\n", "\\n") \
+        .replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if len(pairs) > 0 else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    TYPE = ""
+
+    def __init__(self, name: str, documentation: str,
+                 labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}",
+                 f"# TYPE {self.name} {self.TYPE}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def __init__(self, name: str, documentation: str,
+                 labels: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self.values: Dict[Tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self) -> Iterable[str]:
+        for label_values, value in self.values.items():
+            yield f"{self.name}{_labels(self.labels, label_values)} " \
+                  f"{_number(value)}"
+
+
+class Gauge(Counter):
+    """Gauge set directly or computed by a callback when rendered."""
+    TYPE = "gauge"
+
+    def __init__(self, name: str, documentation: str,
+                 labels: Tuple[str, ...] = (),
+                 callback: Optional[Callable[[], Dict[Tuple, float]]] = None):
+        super().__init__(name, documentation, labels)
+        self.callback = callback
+
+    def set(self, *label_values, value: float) -> None:
+        self.values[label_values] = value
+
+    def samples(self) -> Iterable[str]:
+        if self.callback is not None:
+            self.values = self.callback()
+        return super().samples()
+
+
+class Histogram(Metric):
+    TYPE = "histogram"
+
+    def __init__(self, name: str, documentation: str,
+                 labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+        # label values -> [count of each bucket (and +Inf), sum]
+        self.values: Dict[Tuple, List[float]] = {}
+
+    def observe(self, value: float, *label_values) -> None:
+        data = self.values.get(label_values)
+        if data is None:
+            data = [0] * (len(self.buckets) + 2)
+            self.values[label_values] = data
+        data[bisect_left(self.buckets, value)] += 1
+        data[-1] += value
+
+    def samples(self) -> Iterable[str]:
+        for label_values, data in self.values.items():
+            cumulative = 0
+            for bucket, count in zip(self.buckets + ("+Inf",), data[:-1]):
+                cumulative += count
+                le = f'le="{bucket}"'
+                yield f"{self.name}_bucket" \
+                      f"{_labels(self.labels, label_values, le)} {cumulative}"
+            labels = _labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {_number(data[-1])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Metrics:
+    """Counters of the hot paths of a single mock server (process)."""
+
+    def __init__(self, server):
+        self.server = server
+        # statistics shared by the gauges of a single render
+        self._stats: Optional[Dict] = None
+
+        self.clients = Gauge(
+            "mock_connected_clients", "Connected clients", ("channel",),
+            callback=lambda: {(channel,): count for channel, count
+                              in server.registry.counts().items()})
+        self.messages_received = Counter(
+            "mock_messages_received_total", "Received messages", ("channel",))
+        self.validations = Counter(
+            "mock_validations_total", "Validations of received messages",
+            ("channel", "result"))
+        self.validation_seconds = Histogram(
+            "mock_validation_seconds", "Validation time of received messages",
+            ("channel",))
+        self.frame_cache = Counter(
+            "mock_frame_cache_total", "Lookups and evictions of the cache "
+                                      "of received frames", ("result",))
+        self.frame_cache_entries = Gauge(
+            "mock_frame_cache_entries", "Frames in the cache of received "
+                                        "frames",
+            callback=lambda: {(): len(server.frame_cache)}
+            if server.frame_cache is not None else {})
+        self.configuration_reloads = Counter(
+            "mock_configuration_reloads_total",
+            "Reloads which changed the configuration")
+        self.command_chains = Counter(
+            "mock_command_chains_total", "Command chains by their state",
+            ("event", "state"))
+        self.command_chains_running = Gauge(
+            "mock_command_chains_running",
+            "Running command chains (executing or waiting)",
+            callback=lambda: {(): server.chains.count()})
+        self.broadcast_recipients = Histogram(
+            "mock_broadcast_recipients", "Fan-out size of broadcasts",
+            ("channel",), SIZE_BUCKETS)
+        self.broadcast_seconds = Histogram(
+            "mock_broadcast_seconds", "Fan-out duration of broadcasts",
+            ("channel",))
+        self.send_queue_depth = Gauge(
+            "mock_send_queue_depth", "Messages waiting in send queues",
+            ("channel",), callback=lambda: self._queues("queued"))
+        self.send_queue_dropped = Gauge(
+            "mock_send_queue_dropped",
+            "Messages dropped by send queues of connected clients",
+            ("channel",), callback=lambda: self._queues("dropped"))
+        self.resident_memory = Gauge(
+            "mock_resident_memory_bytes", "Resident memory of the server",
+            callback=lambda: self._memory("rss"))
+        self.memory_per_connection = Gauge(
+            "mock_memory_per_connection_bytes",
+            "Memory allocated since the start of the server "
+            "per connected client",
+            callback=lambda: self._memory("per_connection"))
+
+    def _collected(self) -> Dict:
+        return self._stats if self._stats is not None \
+            else collect(self.server)
+
+    def _queues(self, field: str) -> Dict[Tuple, float]:
+        return {(channel,): channel_stats[field] for channel, channel_stats
+                in self._collected()["channels"].items()}
+
+    def _memory(self, field: str) -> Dict[Tuple, float]:
+        memory = self._collected().get("memory")
+        if memory is None or memory[field] is None:
+            return {}
+        return {(): memory[field]}
+
+    def render(self) -> str:
+        metrics = [value for value in vars(self).values()
+                   if isinstance(value, Metric)]
+        if self.server.worker_id is not None:
+            worker = Gauge("mock_worker", "Id of the worker serving "
+                                          "the metrics", ("worker",))
+            worker.set(self.server.worker_id, value=1)
+            metrics.append(worker)
+        # walks the connected clients once for all the gauges
+        self._stats = collect(self.server)
+        try:
+            return "\n".join(metric.render() for metric in metrics) + "\n"
+        finally:
+            self._stats = None
+
+    def wsgi_app(self, environ, start_response):
+        body = self.render().encode()
+        start_response("200 OK", [("Content-Type", CONTENT_TYPE),
+                                  ("Content-Length", str(len(body)))])
+        return [body]
+
+
+if __name__ == '__main__':
+    from types import SimpleNamespace
+
+    # Text format assertions:
+
+    ex_1_c = Counter("mock_test_total", "Test counter", ("channel",))
+    ex_1_c.inc('a"b\\c\nd')
+    ex_1_c.inc('a"b\\c\nd', amount=2)
+    assert ex_1_c.render() == "\n".join([
+        "# HELP mock_test_total Test counter",
+        "# TYPE mock_test_total counter",
+        'mock_test_total{channel="a\\"b\\\\c\\nd"} 3'])
+
+    ex_1_h = Histogram("mock_test_seconds", "Test histogram", ("channel",),
+                       buckets=(0.1, 1.0))
+    for ex_1_v in [0.05, 0.1, 0.5, 2.0]:
+        ex_1_h.observe(ex_1_v, "chat")
+    assert ex_1_h.render() == "\n".join([
+        "# HELP mock_test_seconds Test histogram",
+        "# TYPE mock_test_seconds histogram",
+        'mock_test_seconds_bucket{channel="chat",le="0.1"} 2',
+        'mock_test_seconds_bucket{channel="chat",le="1.0"} 3',
+        'mock_test_seconds_bucket{channel="chat",le="+Inf"} 4',
+        'mock_test_seconds_sum{channel="chat"} 2.65',
+        'mock_test_seconds_count{channel="chat"} 4'])
+
+    ex_1_g = Gauge("mock_test_gauge", "Test gauge",
+                   callback=lambda: {(): 1.5})
+    assert ex_1_g.render().endswith("\nmock_test_gauge 1.5")
+
+    # Metrics of a server (the statistics are collected once per render):
+
+    ex_2_calls = []
+
+    # replaces stats.collect for the render
+    def collect(server):
+        ex_2_calls.append(server)
+        return {"channels": {"chat": {"queued": 2, "dropped": 1}},
+                "memory": {"rss": 1024, "per_connection": None}}
+
+    ex_2_s = SimpleNamespace(
+        worker_id=3, frame_cache=None,
+        registry=SimpleNamespace(counts=lambda: {"chat": 5}),
+        chains=SimpleNamespace(count=lambda: 0))
+    ex_2_r = Metrics(ex_2_s).render()
+    assert len(ex_2_calls) == 1
+    assert ex_2_r.endswith("\n") and "\n\n" not in ex_2_r
+    for ex_2_l in ['mock_connected_clients{channel="chat"} 5',
+                   'mock_send_queue_depth{channel="chat"} 2',
+                   'mock_send_queue_dropped{channel="chat"} 1',
+                   "mock_resident_memory_bytes 1024",
+                   'mock_worker{worker="3"} 1',
+                   "# TYPE mock_memory_per_connection_bytes gauge"]:
+        assert ex_2_l in ex_2_r.splitlines(), ex_2_l
+    assert not any(ex_2_l.startswith("mock_memory_per_connection_bytes")
+                   for ex_2_l in ex_2_r.splitlines())
@@ -1,18 +1,35 @@
 import argparse
 import logging
-import os
-import time
 from collections import OrderedDict
 
 import gevent
-from yaml import Loader, load
+from gevent.pywsgi import WSGIServer
 from geventwebsocket import WebSocketServer, Resource
 
-from channel import ChannelApplication
+from bus import BroadcastBus
+from chains import ChainRegistry
+from channel import ChannelHandler
+from command import MockedWebSocketServer, execute_command, run_chains
+from configuration import Configuration, load_configuration
+from engine import AsyncioProfiler, AsyncioScheduler, AsyncioServer, \
+    Engines, missing_package, unsupported_arguments
+from frames import FrameCache
+from metrics import Metrics
+from outbound import QueuePolicies, queue_size_argument
+from profiling import DEFAULT_BLOCKING_THRESHOLD, Profiler
+from registry import ChannelRegistry
+from reload import ConfigurationReloader, apply_configuration
+from scheduler import Scheduler
+from stats import report_periodically, rss_bytes
+from validation import Validation, ValidationPool, validation_mode_argument
+from workers import create_listener, run_workers
 
 log = logging.getLogger(__name__)
 
-if __name__ == '__main__':
+METRICS_PATH = "/metrics"
+
+
+def create_argument_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description='SequenceEmitter')
 
     parser.add_argument('specification_file', action="store", type=str)
@@ -21,32 +38,181 @@ if __name__ == '__main__':
                         type=int, default="8080")
     parser.add_argument('--strict', action="store_true", default=False)
     parser.add_argument('--debug', action="store_true", default=False)
+    parser.add_argument('--send-queue-size', action="store",
+                        dest="send_queue_size", type=queue_size_argument,
+                        default=1000)
+    parser.add_argument('--send-queue-policy', action="store",
+                        dest="send_queue_policy", type=str,
+                        choices=QueuePolicies.ALL,
+                        default=QueuePolicies.DROP_OLDEST)
+    parser.add_argument('--stats-interval', action="store",
+                        dest="stats_interval", type=float, default=0)
+    parser.add_argument('--workers', action="store", dest="workers",
+                        type=int, default=1)
+    parser.add_argument('--validation-mode', action="append",
+                        dest="validation_modes",
+                        type=validation_mode_argument, default=[])
+    parser.add_argument('--validation-workers', action="store",
+                        dest="validation_workers", type=int, default=0)
+    parser.add_argument('--frame-cache-size', action="store",
+                        dest="frame_cache_size", type=int, default=0)
+    parser.add_argument('--scheduler-tick', action="store",
+                        dest="scheduler_tick", type=float, default=0.01)
+    parser.add_argument('--cache-dir', action="store", dest="cache_dir",
+                        default=None)
+    parser.add_argument('--reload-interval', action="store",
+                        dest="reload_interval", type=float, default=0)
+    parser.add_argument('--metrics', action="store_true", default=False)
+    parser.add_argument('--metrics-port', action="store",
+                        dest="metrics_port", type=int, default=None)
+    parser.add_argument('--engine', action="store", dest="engine", type=str,
+                        choices=Engines.ALL, default=Engines.GEVENT)
+    parser.add_argument('--socket-buffer-size', action="store",
+                        dest="socket_buffer_size", type=int, default=None)
+    parser.add_argument('--read-buffer-size', action="store",
+                        dest="read_buffer_size", type=int, default=None)
+    parser.add_argument('--profile', action="store", dest="profile",
+                        default=None)
+    parser.add_argument('--profile-blocking', action="store",
+                        dest="profile_blocking", type=float,
+                        default=DEFAULT_BLOCKING_THRESHOLD)
+    return parser
+
+
+def create_server(listener, configuration: Configuration,
+                  args: argparse.Namespace) -> MockedWebSocketServer:
+    # Resource keeps a live view of the routes, so channels added
+    # by a reload are routed without restarting the server
+    routes = OrderedDict()
+    if args.engine == Engines.ASYNCIO:
+        server = AsyncioServer(listener, routes)
+    else:
+        server = WebSocketServer(listener, Resource(routes),
+                                 handler_class=ChannelHandler)
+    server.routes = routes
+    server.metrics = Metrics(server)
+    if args.metrics:
+        routes[f"^{METRICS_PATH}$"] = server.metrics.wsgi_app
+    apply_configuration(server, configuration)
+    # validation workers are forked before any other greenlet is started
+    server.validation = Validation(
+        server, args.validation_modes,
+        ValidationPool(configuration, args, args.validation_workers)
+        if args.validation_workers > 0 else None)
+    server.frame_cache = FrameCache(args.frame_cache_size) \
+        if args.frame_cache_size > 0 else None
+    server.registry = ChannelRegistry()
+    server.chains = ChainRegistry()
+    scheduler = AsyncioScheduler if args.engine == Engines.ASYNCIO \
+        else Scheduler
+    server.scheduler = scheduler(lambda chains: run_chains(chains, server),
+                                 args.scheduler_tick)
+    server.scheduler.start()
+    server.args = args
+    server.worker_id = None
+    server.bus = None
+    # memory allocated after this is reported per connection
+    server.memory_baseline = rss_bytes() or 0
+    server.profiler = None
+    if args.profile is not None:
+        profiler = AsyncioProfiler if args.engine == Engines.ASYNCIO \
+            else Profiler
+        server.profiler = profiler(server, args.profile_blocking)
+        server.profiler.start()
+    return server
+
+
+def serve(server: MockedWebSocketServer) -> None:
+    try:
+        run(server)
+    finally:
+        if server.profiler is not None:
+            server.profiler.dump()
+
+
+def run(server: MockedWebSocketServer) -> None:
+    if isinstance(server, AsyncioServer):
+        server.serve_forever()
+        return
+
+    ConfigurationReloader(server).start(server.args.reload_interval)
+    if server.args.stats_interval > 0:
+        gevent.spawn(report_periodically, server, server.args.stats_interval)
+    host, port = server.address[:2]
+    if server.args.metrics:
+        log.info(f"Serving metrics at {host}:{port}{METRICS_PATH}")
+    if server.args.metrics_port is not None:
+        # every worker serves its own metrics on its own port
+        metrics_port = server.args.metrics_port + (server.worker_id or 0)
+        WSGIServer((host, metrics_port), server.metrics.wsgi_app,
+                   log=None).start()
+        log.info(f"Serving metrics at {host}:{metrics_port}")
+    log.info(f"Started AsyncApi-WebSocket-Mock server at {host}:{port}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = create_argument_parser()
     args = parser.parse_args()
+    if missing_package(args.engine) is not None:
+        parser.error(f"--engine {args.engine} requires the "
+                     f"{missing_package(args.engine)} package "
+                     f"(pip install {missing_package(args.engine)})")
+    if args.engine == Engines.ASYNCIO \
+            and unsupported_arguments(args) is not None:
+        parser.error(f"{unsupported_arguments(args)} is not supported "
+                     f"by the {Engines.ASYNCIO} engine")
 
-    logging.basicConfig(format='[%(asctime)s] %(levelname).1s - %(message)s',
+    logging.basicConfig(format='[%(asctime)s] %(levelname).1s - %(message)s'
+                        if args.workers == 1 else
+                        '[%(asctime)s] [%(process)d] %(levelname).1s - '
+                        '%(message)s',
                         level=logging.DEBUG if args.debug else logging.INFO)
     log.debug("Debug logging level is active")
 
-    with open(args.specification_file, "r") as specification_file:
-        specification = load(specification_file, Loader=Loader)
+    try:
+        configuration = load_configuration(args.specification_file,
+                                           args.events_file, args.cache_dir)
+    except ValueError as e:
+        parser.error(str(e))
+    log.info(f"Registered channels: {configuration.channels}")
 
-    with open(args.events_file, "r") as events_file:
-        events = load(events_file, Loader=Loader)
+    invalid_examples = configuration.invalid_examples
+    invalid_pools = configuration.invalid_pools
+    if len(invalid_examples) > 0 or len(invalid_pools) > 0:
+        if args.strict:
+            log.info("Mock server is going to terminate because of the "
+                     "--strict argument")
+            exit(3)
+        for example in invalid_examples:
+            log.warning(f"Example {example.example_ref} will be sent "
+                        f"even though it is not a valid subscribe message "
+                        f"(use --strict to force the validation)")
+        for pool in invalid_pools:
+            log.warning(f"Payloads generated for message {pool.message_name} "
+                        f"will be sent even though {pool.invalid} of them "
+                        f"are not valid subscribe messages "
+                        f"(use --strict to force the validation)")
 
-    channels = [os.path.join("/", channel_name)
-                for channel_name in specification["channels"].keys()]
+    host = "0.0.0.0"
 
-    log.info(f"Registered channels: {channels}")
+    if args.workers > 1:
+        def serve_worker(worker_id: int, bus_directory: str):
+            server = create_server(
+                create_listener(host, args.port,
+                                buffer_size=args.socket_buffer_size),
+                configuration, args)
+            server.worker_id = worker_id
+            server.bus = BroadcastBus(
+                bus_directory, worker_id, args.workers,
+                lambda command: execute_command(command, server, remote=True))
+            serve(server)
 
-    host = "0.0.0.0"
-    server = WebSocketServer(
-        (host, args.port),
-        Resource(OrderedDict([(channel, ChannelApplication)
-                              for channel in channels]))
-    )
-    server.specification = specification
-    server.events = events
-    server.valid_command_chain_time = time.time()
-    server.args = args
-    log.info(f"Started AsyncApi-WebSocket-Mock server at {host}:{args.port}")
-    server.serve_forever()
+        log.info(f"Starting {args.workers} workers")
+        exit(run_workers(args.workers, serve_worker,
+                         profile=args.profile is not None))
+
+    listener = (host, args.port) if args.socket_buffer_size is None \
+        else create_listener(host, args.port, reuse_port=False,
+                             buffer_size=args.socket_buffer_size)
+    serve(create_server(listener, configuration, args))
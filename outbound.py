@@ -0,0 +1,207 @@
+import argparse
+import logging
+import socket
+from collections import deque
+from typing import Dict, Optional
+
+import gevent
+from geventwebsocket import WebSocketError
+from geventwebsocket.websocket import Header, WebSocket
+
+log = logging.getLogger(__name__)
+
+# WebSocket close code "Policy Violation"
+CLOSE_POLICY_VIOLATION = 1008
+
+
+class QueuePolicies:
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEWEST = "drop_newest"
+    DISCONNECT = "disconnect"
+
+    ALL = [DROP_OLDEST, DROP_NEWEST, DISCONNECT]
+
+
+class PreparedFrame:
+    """A message encoded into a complete WebSocket frame only once,
+    so that the same buffer is written to the socket of every recipient."""
+    __slots__ = ("message", "data")
+
+    def __init__(self, message):
+        self.message = message
+        if isinstance(message, str):
+            opcode = WebSocket.OPCODE_TEXT
+            payload = message.encode("utf-8")
+        else:
+            opcode = WebSocket.OPCODE_BINARY
+            payload = bytes(message)
+        # frames sent by a server are not masked
+        header = Header.encode_header(True, opcode, b"", len(payload), 0)
+        self.data = memoryview(bytes(header) + payload)
+
+
+def queue_size_argument(value: str) -> int:
+    """Parses a --send-queue-size argument, a queue holds
+    at least one message."""
+    try:
+        size = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid send queue size {value}")
+    if size < 1:
+        raise argparse.ArgumentTypeError(
+            f"Send queue size {value} is less than 1")
+    return size
+
+
+class SendQueue:
+    """Bounded outbound queue of a single connection drained by its own
+    writer greenlet, so that a slow client does not block the sender.
+    The writer (and the queue) exist only while there are messages
+    to send - idle connections keep neither of them."""
+    __slots__ = ("ws", "name", "size", "policy", "sent", "dropped", "closed",
+                 "_queue", "_raw", "_writer")
+
+    def __init__(self, ws, name: str, size: int, policy: str):
+        self.ws = ws
+        self.name = name
+        self.size = size
+        self.policy = policy
+        self.sent = 0
+        self.dropped = 0
+        self.closed = False
+        self._queue: Optional[deque] = None
+        # prepared frames are written directly to the socket when possible
+        self._raw = getattr(ws, "raw_write", None) is not None
+        self._writer = None
+
+    @property
+    def depth(self) -> int:
+        return len(self._queue) if self._queue is not None else 0
+
+    def put(self, message) -> bool:
+        """Enqueues a message without blocking.
+        :return: False when the message (or the connection) was dropped
+        because of a full queue or a closed connection
+        """
+        if self.closed:
+            return False
+
+        if self._queue is None:
+            self._queue = deque()
+        elif len(self._queue) >= self.size:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                log.warning(f"Send queue of client {self.name} is full "
+                            f"({self.size} messages, {self.dropped} dropped, "
+                            f"policy {self.policy})")
+
+            if self.policy == QueuePolicies.DROP_NEWEST:
+                return False
+            elif self.policy == QueuePolicies.DISCONNECT:
+                self.disconnect()
+                return False
+            # QueuePolicies.DROP_OLDEST
+            self._queue.popleft()
+
+        self._queue.append(message)
+        if self._writer is None:
+            self._writer = self._spawn()
+        return True
+
+    def _spawn(self):
+        return gevent.spawn(self._drain)
+
+    def _drain(self):
+        queue = self._queue
+        try:
+            while len(queue) > 0:
+                message = queue.popleft()
+                try:
+                    if isinstance(message, PreparedFrame):
+                        self._send_prepared(message)
+                    else:
+                        self.ws.send(message)
+                    self.sent += 1
+                except WebSocketError:
+                    log.debug(f"Client {self.name} is gone, "
+                              f"dropping {len(queue)} queued messages")
+                    self.closed = True
+                    return
+        finally:
+            self._drained()
+
+    def _drained(self) -> None:
+        # nothing yields between the last check of the queue and here,
+        # so no message is left without a writer
+        self._writer = None
+        self._queue = None
+
+    def _send_prepared(self, frame: PreparedFrame):
+        if not self._raw:
+            self.ws.send(frame.message)
+            return
+
+        write = self.ws.raw_write
+        if self.ws.closed or write is None:
+            raise WebSocketError("Socket is closed")
+        try:
+            write(frame.data)
+        except OSError as e:
+            raise WebSocketError(f"Socket is dead: {e}")
+
+    def disconnect(self):
+        """Closes the connection of a client which is falling behind."""
+        log.warning(f"Disconnecting client {self.name} "
+                    f"with a full send queue")
+        self.close()
+        try:
+            # the socket is shut down first - sending a close frame
+            # would block on a client which does not read anymore,
+            # the shutdown also wakes up the greenlet reading from it
+            self.ws.handler.socket.shutdown(socket.SHUT_RDWR)
+            self.ws.close(CLOSE_POLICY_VIOLATION)
+        except (WebSocketError, OSError, AttributeError):
+            pass
+
+    def close(self):
+        self.closed = True
+        self._queue = None
+        if self._writer is not None:
+            self._writer.kill(block=False)
+
+    def stats(self) -> Dict:
+        return {
+            "client": self.name,
+            "depth": self.depth,
+            "sent": self.sent,
+            "dropped": self.dropped,
+        }
+
+
+if __name__ == '__main__':
+    # Prepared frame assertions (the same bytes as written by ws.send):
+
+    class RecordingStream:
+        def __init__(self):
+            self.written = b""
+
+        def write(self, data):
+            self.written += bytes(data)
+
+        def read(self, size):
+            return b""
+
+    for ex_1_m in ["Hello World", "ž" * 200, "x" * 70000, b"\x00\x01" * 10]:
+        ex_1_s = RecordingStream()
+        ex_1_w = WebSocket(None, ex_1_s, None)
+        ex_1_w.send(ex_1_m)
+        assert bytes(PreparedFrame(ex_1_m).data) == ex_1_s.written
+
+    # Send queue size assertions:
+    assert queue_size_argument("1") == 1
+    for ex_2_v in ["0", "-5", "many"]:
+        try:
+            queue_size_argument(ex_2_v)
+            assert False
+        except argparse.ArgumentTypeError:
+            pass
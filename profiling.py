@@ -0,0 +1,298 @@
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+import gevent
+import greenlet
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BLOCKING_THRESHOLD = 0.1
+# seconds between two samples of the stack of the server
+SAMPLE_INTERVAL = 0.01
+MAX_STACK_DEPTH = 64
+# the most recent blocking events are kept with their stacks
+MAX_BLOCKING_EVENTS = 100
+
+
+class Timing:
+    """Number, total and maximum of measured durations."""
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def summary(self) -> Dict:
+        return {
+            "count": self.count,
+            "total_seconds": self.total,
+            "mean_seconds": self.total / self.count if self.count > 0 else 0,
+            "max_seconds": self.max,
+        }
+
+
+class Profiler:
+    """Profiles a running server (--profile) at a cost low enough
+    for a server under load:
+    - CPU time of greenlets, measured when they switch
+    - stacks of the server thread sampled by a separate thread,
+      written in the collapsed format of flamegraph.pl
+    - blocking of the event loop, detected by a heartbeat greenlet
+      waking up later than the threshold, with the stack it was blocked at
+    - time of every command step and of every command chain
+    The results are written on shutdown and on SIGUSR1."""
+
+    def __init__(self, server, blocking_threshold: float =
+                 DEFAULT_BLOCKING_THRESHOLD):
+        self.server = server
+        self.blocking_threshold = blocking_threshold
+        # label of greenlets -> [CPU seconds, switches]
+        self.greenlets: Dict[str, List] = {}
+        # collapsed stack -> number of samples
+        self.stacks: Dict[str, int] = {}
+        self.samples = 0
+        self.blocking = Timing()
+        self.blocking_events = deque(maxlen=MAX_BLOCKING_EVENTS)
+        self.commands: Dict[str, Timing] = {}
+        self.chains: Dict[str, Dict] = {}
+        # chain -> [start, seconds spent executing its commands]
+        self._running: Dict = {}
+        # the stacks are collected by the sampling thread
+        self._lock = threading.Lock()
+        self._thread_id = threading.get_ident()
+        self._frame_labels: Dict = {}
+        # label of the running greenlet, None when greenlets are not traced
+        self._current: Optional[str] = None
+        self._cpu = 0.0
+        self._beat_interval = blocking_threshold / 2
+        # time the heartbeat is expected at
+        self._beat = 0.0
+        self._blocked_stack = None
+        self._started = 0.0
+        self._cpu_started = 0.0
+
+    @property
+    def path(self) -> str:
+        """path of the results without the extension"""
+        worker_id = self.server.worker_id
+        return self.server.args.profile if worker_id is None \
+            else f"{self.server.args.profile}-{worker_id}"
+
+    def start(self) -> None:
+        self._started = time.perf_counter()
+        self._cpu_started = time.process_time()
+        self._beat = self._started + self._beat_interval
+        self._trace_switches()
+        self._spawn_heartbeat()
+        threading.Thread(target=self._sample, name="profiler",
+                         daemon=True).start()
+        self._on_signal(signal.SIGUSR1, self.dump)
+        # written by the server when it exits
+        self._on_signal(signal.SIGTERM, _terminate)
+        log.info(f"Profiling the server (blocking threshold "
+                 f"{self.blocking_threshold * 1000:.0f} ms)")
+
+    def _trace_switches(self) -> None:
+        self._current = greenlet_label(greenlet.getcurrent())
+        self._cpu = time.thread_time()
+        greenlet.settrace(self._trace)
+
+    def _trace(self, event: str, args) -> None:
+        if event != "switch" and event != "throw":
+            return
+        now = time.thread_time()
+        times = self.greenlets.get(self._current)
+        if times is None:
+            times = self.greenlets[self._current] = [0.0, 0]
+        times[0] += now - self._cpu
+        times[1] += 1
+        self._cpu = now
+        self._current = greenlet_label(args[1])
+
+    def _spawn_heartbeat(self) -> None:
+        gevent.spawn(self._heartbeat)
+
+    def _heartbeat(self) -> None:
+        while True:
+            gevent.sleep(self._beat_interval)
+            self._beat_step()
+
+    def _beat_step(self) -> None:
+        now = time.perf_counter()
+        late = now - self._beat
+        self._beat = now + self._beat_interval
+        blocked, self._blocked_stack = self._blocked_stack, None
+        if late < self.blocking_threshold:
+            return
+
+        self.blocking.add(late)
+        label, stack = blocked if blocked is not None else (None, [])
+        self.blocking_events.append({
+            "time": time.time(),
+            "seconds": late,
+            "greenlet": label,
+            "stack": stack,
+        })
+        log.warning(f"Event loop was blocked for {late * 1000:.0f} ms"
+                    f"{f' by {label}' if label is not None else ''}"
+                    f"{f' in {stack[-1]}' if len(stack) > 0 else ''}")
+
+    def _on_signal(self, signum: int, handler) -> None:
+        gevent.signal_handler(signum, handler)
+
+    def _sample(self) -> None:
+        """Samples the stack of the server thread
+        (run by the profiler thread)."""
+        while True:
+            time.sleep(SAMPLE_INTERVAL)
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            label = self._current
+            stack = self._stack(frame)
+            if time.perf_counter() - self._beat > self.blocking_threshold \
+                    and self._blocked_stack is None:
+                # the heartbeat reports it once the loop runs again
+                self._blocked_stack = (label, stack)
+
+            collapsed = ";".join(stack if label is None else [label] + stack)
+            with self._lock:
+                self.samples += 1
+                self.stacks[collapsed] = self.stacks.get(collapsed, 0) + 1
+
+    def _stack(self, frame) -> List[str]:
+        """:return: labels of the frames, the outermost first"""
+        stack = []
+        while frame is not None and len(stack) < MAX_STACK_DEPTH:
+            code = frame.f_code
+            label = self._frame_labels.get(code)
+            if label is None:
+                label = self._frame_labels[code] = \
+                    f"{getattr(code, 'co_qualname', code.co_name)} " \
+                    f"({os.path.basename(code.co_filename)}:" \
+                    f"{code.co_firstlineno})"
+            stack.append(label)
+            frame = frame.f_back
+        stack.reverse()
+        return stack
+
+    def chain_started(self, chain) -> None:
+        self._running[chain] = [time.perf_counter(), 0.0]
+
+    def command_executed(self, command_name: str, seconds: float,
+                         chain=None) -> None:
+        timing = self.commands.get(command_name)
+        if timing is None:
+            timing = self.commands[command_name] = Timing()
+        timing.add(seconds)
+        running = self._running.get(chain) if chain is not None else None
+        if running is not None:
+            running[1] += seconds
+
+    def chain_finished(self, chain, outcome: str) -> None:
+        """:param outcome: completed, failed or stopped"""
+        running = self._running.pop(chain, None)
+        if running is None:
+            return
+        timings = self.chains.get(chain.name)
+        if timings is None:
+            timings = self.chains[chain.name] = {
+                "outcomes": {}, "busy": Timing(), "wall": Timing()}
+        timings["outcomes"][outcome] = timings["outcomes"].get(outcome, 0) + 1
+        # time spent executing the commands and from the start to the end
+        timings["busy"].add(running[1])
+        timings["wall"].add(time.perf_counter() - running[0])
+
+    def summary(self) -> Dict:
+        with self._lock:
+            samples = self.samples
+        return {
+            "pid": os.getpid(),
+            "worker": self.server.worker_id,
+            "engine": self.server.args.engine,
+            "seconds": time.perf_counter() - self._started,
+            "cpu_seconds": time.process_time() - self._cpu_started,
+            "greenlets": {
+                label: {"cpu_seconds": times[0], "switches": times[1]}
+                for label, times in sorted(self.greenlets.items(),
+                                           key=lambda item: -item[1][0])},
+            "samples": samples,
+            "sample_interval": SAMPLE_INTERVAL,
+            "blocking": dict(self.blocking.summary(),
+                             threshold_seconds=self.blocking_threshold,
+                             events=list(self.blocking_events)),
+            "commands": {name: timing.summary()
+                         for name, timing in self.commands.items()},
+            "chains": {
+                name: {"outcomes": timings["outcomes"],
+                       "busy": timings["busy"].summary(),
+                       "wall": timings["wall"].summary()}
+                for name, timings in self.chains.items()},
+            "running_chains": len(self._running),
+        }
+
+    def dump(self) -> None:
+        """Writes the collapsed stacks and the JSON summary."""
+        path = self.path
+        with self._lock:
+            stacks = sorted(self.stacks.items())
+        _write(f"{path}.folded",
+               "".join(f"{stack} {count}\n" for stack, count in stacks))
+        _write(f"{path}.json", json.dumps(self.summary(), indent=2))
+        log.info(f"Profile written to {path}.json and {path}.folded")
+
+
+def greenlet_label(glet) -> str:
+    """:return: function of a gevent greenlet (e.g. `SendQueue._drain`),
+    its class for other greenlets (e.g. `Hub`)"""
+    run = getattr(glet, "_run", None)
+    if run is not None:
+        return getattr(run, "__qualname__", type(run).__name__)
+    if glet.parent is None:
+        return "main"
+    return type(glet).__name__
+
+
+def _write(path: str, content: str) -> None:
+    # readers never see a partially written file
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as file:
+        file.write(content)
+    os.replace(temporary, path)
+
+
+def _terminate() -> None:
+    log.info("Mock server is going to terminate because of SIGTERM")
+    raise SystemExit(0)
+
+
+if __name__ == '__main__':
+    # Timing assertions:
+    ex_1_t = Timing()
+    for ex_1_s in [0.5, 0.25, 2.0, 0.25]:
+        ex_1_t.add(ex_1_s)
+    assert ex_1_t.summary() == {"count": 4, "total_seconds": 3.0,
+                                "mean_seconds": 0.75, "max_seconds": 2.0}
+    assert Timing().summary()["mean_seconds"] == 0
+
+    # Greenlet label assertions:
+    def ex_2_run():
+        pass
+
+    assert greenlet_label(gevent.spawn(ex_2_run)) == "ex_2_run"
+    assert greenlet_label(greenlet.getcurrent()) == "main"
+    assert greenlet_label(gevent.get_hub()) == "Hub"
@@ -0,0 +1,59 @@
+import logging
+from typing import Dict, Iterable, Tuple
+
+log = logging.getLogger(__name__)
+
+
+def channel_key(channel_name: str) -> str:
+    """Normalizes a channel name or a WebSocket path ("/chat", "chat/")
+    to the key used by the registry ("chat")."""
+    return channel_name.strip("/")
+
+
+class ChannelRegistry:
+    """Index of connected clients by the channel they are subscribed to
+    and by (channel, tag) of the tags of their connections."""
+
+    def __init__(self):
+        self._subscribers: Dict[str, Dict] = {}
+        self._tagged: Dict[Tuple[str, str], Dict] = {}
+
+    def add(self, channel_name: str, client,
+            tags: Iterable[str] = ()) -> None:
+        key = channel_key(channel_name)
+        self._subscribers.setdefault(key, {})[client] = None
+        for tag in tags:
+            self._tagged.setdefault((key, tag), {})[client] = None
+
+    def remove(self, channel_name: str, client,
+               tags: Iterable[str] = ()) -> None:
+        key = channel_key(channel_name)
+        for tag in tags:
+            _discard(self._tagged, (key, tag), client)
+        _discard(self._subscribers, key, client)
+
+    def subscribers(self, channel_name: str) -> Iterable:
+        """:return: snapshot of clients subscribed to the channel
+        (safe to iterate while clients join or leave)"""
+        return tuple(self._subscribers.get(channel_key(channel_name), ()))
+
+    def tagged(self, channel_name: str, tag: str) -> Iterable:
+        """:return: snapshot of clients of the channel with the tag"""
+        return tuple(self._tagged.get((channel_key(channel_name), tag), ()))
+
+    def count(self, channel_name: str) -> int:
+        return len(self._subscribers.get(channel_key(channel_name), ()))
+
+    def counts(self) -> Dict[str, int]:
+        """:return: number of subscribers of each channel with any"""
+        return {key: len(subscribers)
+                for key, subscribers in self._subscribers.items()}
+
+
+def _discard(index: Dict, key, client) -> None:
+    clients = index.get(key)
+    if clients is None:
+        return
+    clients.pop(client, None)
+    if len(clients) == 0:
+        del index[key]
@@ -0,0 +1,127 @@
+import logging
+import os
+import signal
+import time
+from typing import Optional, Tuple
+
+import gevent
+
+from channel import ChannelApplication
+from command import MockedWebSocketServer
+from configuration import Configuration, load_configuration
+
+log = logging.getLogger(__name__)
+
+
+def apply_configuration(server: MockedWebSocketServer,
+                        configuration: Configuration) -> None:
+    """Swaps the configuration of the server and registers routes of its
+    channels. Nothing here yields to other greenlets, so connections and
+    command chains see either the old or the new configuration."""
+    previous = getattr(server, "configuration", None)
+    channels = configuration.channels
+    if previous is not None:
+        for channel in previous.channels:
+            if channel not in channels:
+                # connected clients stay, new connections are refused
+                server.routes.pop(channel, None)
+    for channel in channels:
+        if channel not in server.routes:
+            server.routes[channel] = ChannelApplication
+
+    server.configuration = configuration
+    server.specification = configuration.specification
+    server.events = configuration.events
+    server.dispatch = configuration.dispatch
+    server.validators = configuration.validators
+    server.classifiers = configuration.classifiers
+    server.codecs = configuration.codecs
+    server.examples = configuration.examples
+    server.generated = configuration.generated
+
+
+class ConfigurationReloader:
+    """Reloads the configuration files of a running server
+    on SIGHUP or when they are modified."""
+
+    def __init__(self, server: MockedWebSocketServer):
+        self.server = server
+        self._reloading = None
+        self._last_modified = self._modified()
+
+    def _files(self) -> Tuple[str, str]:
+        return self.server.args.specification_file, \
+            self.server.args.events_file
+
+    def _modified(self) -> Tuple:
+        modified = []
+        for path in self._files():
+            try:
+                status = os.stat(path)
+                modified.append((status.st_mtime_ns, status.st_size))
+            except OSError:
+                modified.append(None)
+        return tuple(modified)
+
+    def reload(self) -> bool:
+        """:return: True when a changed configuration has been applied"""
+        start = time.perf_counter()
+        specification_file, events_file = self._files()
+        try:
+            configuration = load_configuration(
+                specification_file, events_file, self.server.args.cache_dir,
+                previous=self.server.configuration)
+        except Exception:
+            log.exception("Reloading the configuration failed, "
+                          "keeping the current one")
+            return False
+
+        if configuration is self.server.configuration:
+            log.info("Configuration files have not changed")
+            return False
+
+        for example in configuration.invalid_examples:
+            log.warning(f"Example {example.example_ref} is not a valid "
+                        f"subscribe message after the reload")
+        for pool in configuration.invalid_pools:
+            log.warning(f"{pool.invalid} payloads generated for message "
+                        f"{pool.message_name} are not valid subscribe "
+                        f"messages after the reload")
+        apply_configuration(self.server, configuration)
+        if self.server.frame_cache is not None:
+            # frames are classified by the previous validators
+            self.server.frame_cache.clear()
+        if self.server.validation.pool is not None:
+            self.server.validation.pool.reload()
+        self.server.metrics.configuration_reloads.inc()
+        log.info(f"Reloaded configuration in "
+                 f"{(time.perf_counter() - start) * 1000:.1f} ms")
+        return True
+
+    def reload_soon(self) -> None:
+        """Reloads in a separate greenlet (e.g. from a signal handler),
+        once at a time."""
+        if self._reloading is None or self._reloading.dead:
+            self._reloading = gevent.spawn(self.reload)
+
+    def check(self) -> bool:
+        """Reloads the configuration files when they have been modified
+        since the previous check.
+        :return: True when a changed configuration has been applied"""
+        current = self._modified()
+        if current == self._last_modified or None in current:
+            return False
+        self._last_modified = current
+        log.info("Configuration files have been modified")
+        return self.reload()
+
+    def watch(self, interval: float) -> None:
+        """Polls modification times of the configuration files."""
+        while True:
+            gevent.sleep(interval)
+            self.check()
+
+    def start(self, interval: Optional[float] = None) -> None:
+        gevent.signal_handler(signal.SIGHUP, self.reload_soon)
+        if interval is not None and interval > 0:
+            gevent.spawn(self.watch, interval)
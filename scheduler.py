@@ -0,0 +1,186 @@
+import logging
+import math
+import time
+from typing import Any, Callable, List, Optional, Tuple
+
+import gevent
+from gevent.event import Event
+
+log = logging.getLogger(__name__)
+
+
+class TimingWheel:
+    """Hierarchical timing wheel. Level 0 has a slot for every tick,
+    each higher level has a slot for `slots` slots of the level below.
+    Entries of a higher level are cascaded down when their slot is reached,
+    so a tick only touches the entries which are (almost) due."""
+
+    def __init__(self, slots: int = 64, levels: int = 4):
+        self.slots = slots
+        self.levels = levels
+        self.tick = 0
+        self.size = 0
+        self._spans = [slots ** level for level in range(levels + 1)]
+        self._wheels: List[List[List[Tuple[int, Any]]]] = [
+            [[] for _ in range(slots)] for _ in range(levels)]
+
+    def add(self, entry: Any, due_tick: int) -> None:
+        """Adds an entry due at the given tick
+        (at the next tick when it is already due)."""
+        self.size += 1
+        self._insert(entry, max(due_tick, self.tick + 1))
+
+    def _insert(self, entry: Any, due_tick: int) -> None:
+        delta = due_tick - self.tick
+        for level in range(self.levels):
+            if delta < self._spans[level + 1] or level == self.levels - 1:
+                slot = (due_tick // self._spans[level]) % self.slots
+                self._wheels[level][slot].append((due_tick, entry))
+                return
+
+    def advance(self) -> List[Any]:
+        """Moves the wheel by one tick.
+        :return: entries due at the new tick
+        """
+        self.tick += 1
+
+        # cascade from the highest level, so that the entries moved down
+        # to a level which is cascaded at this tick as well are not missed
+        for level in range(self.levels - 1, 0, -1):
+            if self.tick % self._spans[level] == 0:
+                slot = (self.tick // self._spans[level]) % self.slots
+                entries = self._wheels[level][slot]
+                self._wheels[level][slot] = []
+                for due_tick, entry in entries:
+                    self._insert(entry, due_tick)
+
+        slot = self.tick % self.slots
+        entries = self._wheels[0][slot]
+        self._wheels[0][slot] = []
+        self.size -= len(entries)
+        return [entry for _, entry in entries]
+
+
+class Scheduler:
+    """Runs scheduled entries from a single greenlet. All entries due
+    at the same tick are passed to `run` together as one batch."""
+
+    def __init__(self, run: Callable[[List[Any]], None],
+                 resolution: float = 0.01):
+        self.run = run
+        self.resolution = resolution
+        self.wheel = TimingWheel()
+        self._ready: List[Any] = []
+        self._wakeup = Event()
+        # time of the tick 0 of the wheel
+        self._origin = time.monotonic()
+        self._driver = None
+
+    @property
+    def pending(self) -> int:
+        return self.wheel.size + len(self._ready)
+
+    def start(self) -> None:
+        self._driver = gevent.spawn(self._drive)
+
+    def call_soon(self, entry: Any) -> None:
+        self._ready.append(entry)
+        self._wakeup.set()
+
+    def schedule(self, entry: Any, delay: float) -> None:
+        if delay <= 0:
+            self.call_soon(entry)
+            return
+
+        now = time.monotonic()
+        if self.wheel.size == 0:
+            # the wheel does not move while it is empty - catch up with time
+            self._origin = now - self.wheel.tick * self.resolution
+
+        self.wheel.add(entry, math.ceil((now + delay - self._origin)
+                                        / self.resolution))
+        self._wakeup.set()
+
+    def _run(self, entries: List[Any]) -> None:
+        try:
+            self.run(entries)
+        except Exception:
+            log.exception(f"Scheduler failed to run {len(entries)} entries")
+
+    def step(self) -> Optional[float]:
+        """Runs the entries which are ready or due (the driver of the
+        scheduler calls it whenever the previous step says so).
+        :return: seconds until the next step, None when nothing is scheduled
+        """
+        ran = len(self._ready) > 0
+        if ran:
+            ready, self._ready = self._ready, []
+            self._run(ready)
+
+        # every tick already due is run as well, so that entries which are
+        # ready at every step do not hold the scheduled ones back
+        while self.wheel.size > 0:
+            delay = self._origin + (self.wheel.tick + 1) * self.resolution \
+                - time.monotonic()
+            if delay > 0:
+                return 0 if ran else delay
+
+            due = self.wheel.advance()
+            if len(due) > 0:
+                self._run(due)
+                ran = True
+        return 0 if ran else None
+
+    def _drive(self):
+        while True:
+            delay = self.step()
+            if delay == 0:
+                # let the connections run between consecutive batches
+                gevent.sleep(0)
+            else:
+                self._wakeup.clear()
+                self._wakeup.wait(delay)
+
+
+if __name__ == '__main__':
+    import random
+
+    # Timing wheel assertions:
+
+    ex_1_w = TimingWheel(slots=4, levels=3)
+    ex_1_due = {}
+    for ex_1_i in range(500):
+        ex_1_t = random.randint(1, 200)
+        ex_1_w.add(ex_1_i, ex_1_t)
+        ex_1_due[ex_1_i] = ex_1_t
+
+    for ex_1_tick in range(1, 301):
+        for ex_1_i in ex_1_w.advance():
+            assert ex_1_due.pop(ex_1_i) == ex_1_tick
+        # entries added while the wheel moves (beyond the span of the wheel)
+        if ex_1_tick <= 200 and ex_1_tick % 7 == 0:
+            ex_1_w.add(("late", ex_1_tick), ex_1_tick + 70)
+            ex_1_due[("late", ex_1_tick)] = ex_1_tick + 70
+    assert len(ex_1_due) == 0 and ex_1_w.size == 0
+
+    # Scheduled entries are run on time while other entries are always ready:
+
+    ex_2_fired = []
+
+    def ex_2_run(entries):
+        for entry in entries:
+            if entry == "soon":
+                if len(ex_2_fired) == 0:
+                    ex_2_s.call_soon("soon")
+                time.sleep(0.001)
+            else:
+                ex_2_fired.append(time.monotonic())
+
+    ex_2_s = Scheduler(ex_2_run)
+    ex_2_s.start()
+    ex_2_s.call_soon("soon")
+    ex_2_start = time.monotonic()
+    ex_2_s.schedule("wait", 0.05)
+    gevent.sleep(0.5)
+    assert len(ex_2_fired) == 1 and ex_2_fired[0] - ex_2_start < 0.1, \
+        ex_2_fired
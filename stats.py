@@ -0,0 +1,77 @@
+import logging
+import os
+from typing import Dict, Optional
+
+import gevent
+
+log = logging.getLogger(__name__)
+
+
+def collect(server) -> Dict:
+    """:return: snapshot of subscriber counts and of the send queues
+    of clients which are falling behind (queued or dropped messages)"""
+    channels = {}
+    for channel, count in server.registry.counts().items():
+        queues = [client.outbound.stats()
+                  for client in server.registry.subscribers(channel)]
+        channels[channel] = {
+            "clients": count,
+            "queued": sum(queue["depth"] for queue in queues),
+            "dropped": sum(queue["dropped"] for queue in queues),
+            "lagging": [queue for queue in queues
+                        if queue["depth"] > 0 or queue["dropped"] > 0],
+        }
+    stats = {"channels": channels}
+
+    rss = rss_bytes()
+    if rss is not None:
+        connections = sum(server.registry.counts().values())
+        stats["memory"] = {
+            "rss": rss,
+            "connections": connections,
+            # everything allocated since the server started
+            # is attributed to the connections
+            "per_connection": (rss - server.memory_baseline) / connections
+            if connections > 0 else None,
+        }
+    if server.worker_id is not None:
+        stats["worker"] = server.worker_id
+        stats["bus"] = server.bus.stats()
+    return stats
+
+
+def rss_bytes() -> Optional[int]:
+    """:return: resident memory of this process, None when unknown"""
+    try:
+        with open("/proc/self/statm", "r") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def report(server) -> None:
+    stats = collect(server)
+    prefix = f"Worker {stats['worker']}: " if "worker" in stats else ""
+    if "bus" in stats:
+        log.info(f"{prefix}{stats['bus']['published']} commands published, "
+                 f"{stats['bus']['received']} received over the bus")
+    memory = stats.get("memory")
+    if memory is not None and memory["per_connection"] is not None:
+        log.info(f"{prefix}{memory['rss'] / 2 ** 20:.1f} MiB resident, "
+                 f"{memory['per_connection']:.0f} bytes per connection "
+                 f"({memory['connections']} connections)")
+    for channel, channel_stats in stats["channels"].items():
+        log.info(f"{prefix}Channel {channel}: "
+                 f"{channel_stats['clients']} clients, "
+                 f"{channel_stats['queued']} queued, "
+                 f"{channel_stats['dropped']} dropped messages")
+        for queue in channel_stats["lagging"]:
+            log.info(f"  client {queue['client']}: "
+                     f"{queue['depth']} queued, {queue['sent']} sent, "
+                     f"{queue['dropped']} dropped")
+
+
+def report_periodically(server, interval: float) -> None:
+    while True:
+        gevent.sleep(interval)
+        report(server)
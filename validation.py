@@ -0,0 +1,329 @@
+import argparse
+import logging
+import os
+import random
+import signal
+import struct
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import gevent
+from gevent import socket
+from gevent.event import Event
+
+from command import MockedWebSocketServer
+from configuration import Configuration, load_configuration
+from registry import channel_key
+
+log = logging.getLogger(__name__)
+
+# frames sent to validation workers: kind, channel length, frame length
+REQUEST = struct.Struct("!BHI")
+REQUEST_TEXT = 0
+REQUEST_BINARY = 1
+REQUEST_RELOAD = 2
+# results of validation workers: passed, seconds, channel length
+RESULT = struct.Struct("!BdH")
+
+
+class ValidationModes:
+    FULL = "full"
+    SAMPLED = "sampled"
+    OFF = "off"
+
+    ALL = [FULL, f"{SAMPLED}:<rate>", OFF]
+
+
+class ValidationMode:
+    __slots__ = ("kind", "rate")
+
+    def __init__(self, kind: str, rate: float = 1.0):
+        self.kind = kind
+        # fraction of the validated messages of the sampled mode
+        self.rate = rate
+
+    def __repr__(self) -> str:
+        return f"{self.kind}:{self.rate}" \
+            if self.kind == ValidationModes.SAMPLED else self.kind
+
+
+def validation_mode_argument(value: str
+                             ) -> Tuple[Optional[str], ValidationMode]:
+    """Parses a --validation-mode argument - "<mode>" for all channels
+    or "<channel>=<mode>".
+    :return: (channel or None for all channels, mode)
+    """
+    channel, _, mode = value.rpartition("=")
+    kind, _, rate = mode.partition(":")
+
+    if kind in (ValidationModes.FULL, ValidationModes.OFF) and rate == "":
+        parsed = ValidationMode(kind)
+    elif kind == ValidationModes.SAMPLED:
+        try:
+            parsed = ValidationMode(kind, float(rate))
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Invalid sampling rate {rate}")
+        if not 0 <= parsed.rate <= 1:
+            raise argparse.ArgumentTypeError(
+                f"Sampling rate {rate} is not between 0 and 1")
+    else:
+        raise argparse.ArgumentTypeError(
+            f"Invalid validation mode {mode} (use one of "
+            f"{', '.join(ValidationModes.ALL)})")
+
+    return channel_key(channel) if channel else None, parsed
+
+
+class Validation:
+    """Validates received messages according to the validation mode
+    of their channel. Messages which are not validated (or validated
+    by the worker pool) are dispatched by the names of the messages
+    they could be (see `compiler.compile_classifier`)."""
+
+    def __init__(self, server: MockedWebSocketServer,
+                 modes: List[Tuple[Optional[str], ValidationMode]],
+                 pool: Optional["ValidationPool"] = None):
+        self.server = server
+        # the last mode of a channel wins
+        self.modes: Dict[Optional[str], ValidationMode] = dict(modes)
+        self.default = self.modes.pop(None, ValidationMode(
+            ValidationModes.FULL))
+        self.pool = pool
+        if pool is not None:
+            pool.start(self.report)
+
+    def mode(self, channel: str) -> ValidationMode:
+        return self.modes.get(channel_key(channel), self.default)
+
+    def process(self, channel: str, mode: ValidationMode, frame: Any,
+                data: Any) -> List[str]:
+        """:param frame: the received frame (for the worker pool)
+        :param data: the decoded frame
+        :return: names of the messages for event dispatch
+        """
+        if mode.kind == ValidationModes.FULL:
+            messages = self.validate(channel, data)
+            if len(messages) == 0:
+                self._not_dispatched(channel)
+            else:
+                log.info(f"Following messages passed validation "
+                         f"for sent data: {messages}")
+            return messages
+
+        messages = self.server.classifiers[channel]["publish"](data)
+        if mode.kind == ValidationModes.SAMPLED \
+                and random.random() < mode.rate:
+            if self.pool is None:
+                self.validate(channel, data)
+            elif not self.pool.submit(channel, frame):
+                self.server.metrics.validations.inc(channel, "skipped")
+        else:
+            self.server.metrics.validations.inc(channel, "skipped")
+        return messages
+
+    def undecodable(self, channel: str, error: Exception) -> None:
+        """Counts a received frame which cannot be decoded as failed."""
+        self.failed(channel, f"/{channel} - Received message cannot "
+                             f"be decoded: {error}")
+        self._not_dispatched(channel)
+
+    @staticmethod
+    def _not_dispatched(channel: str) -> None:
+        log.warning(f"Received message is not a valid publish "
+                    f"message for channel {channel}. The server will "
+                    f"continue listening, however no message_received "
+                    f"event will be triggered (use --strict to "
+                    f"terminate this server in this situation)")
+
+    def account(self, channel: str, mode: ValidationMode, frame: Any,
+                decode: Callable[[Any], Any]) -> None:
+        """Counts a frame whose messages are known from the frame cache
+        (only valid or classified frames are cached) - the sampled mode
+        still validates it at its rate.
+        :param decode: decodes the frame when it is validated
+        """
+        if mode.kind == ValidationModes.FULL:
+            self.server.metrics.validations.inc(channel, "passed")
+            return
+        if mode.kind == ValidationModes.SAMPLED \
+                and random.random() < mode.rate:
+            if self.pool is None:
+                self.validate(channel, decode(frame))
+                return
+            if self.pool.submit(channel, frame):
+                return
+        self.server.metrics.validations.inc(channel, "skipped")
+
+    def validate(self, channel: str, data: Any) -> List[str]:
+        start = time.perf_counter()
+        messages = self.server.validators[channel]["publish"](data)
+        self.report(channel, len(messages) > 0, time.perf_counter() - start)
+        return messages
+
+    def report(self, channel: str, passed: bool, seconds: float) -> None:
+        self.server.metrics.validation_seconds.observe(seconds, channel)
+        if passed:
+            self.server.metrics.validations.inc(channel, "passed")
+            return
+        self.failed(channel, f"Sent data did not pass validation "
+                             f"for any of the specified messages "
+                             f"of channel {channel}")
+
+    def failed(self, channel: str, reason: str) -> None:
+        """Counts a received message which is not valid (including frames
+        which cannot be decoded at all)."""
+        self.server.metrics.validations.inc(channel, "failed")
+        log.error(reason)
+        if self.server.args.strict:
+            log.info("Mock server is going to terminate because of the "
+                     "--strict argument")
+            exit(3)
+
+
+class ValidationPool:
+    """Processes validating sampled messages outside of the server process.
+    They are forked with the compiled configuration, receive raw frames
+    and send back only the results. Frames are dropped (not validated)
+    when the queue of a worker is full."""
+
+    def __init__(self, configuration: Configuration,
+                 args: argparse.Namespace, workers: int,
+                 queue_size: int = 1000):
+        self.queue_size = queue_size
+        self._sockets: List[socket.socket] = []
+        self._queues: List[deque] = []
+        self._ready: List[Event] = []
+        self._alive: List[bool] = []
+        self._next = 0
+
+        for worker_id in range(workers):
+            parent, child = socket.socketpair()
+            pid = gevent.fork()
+            if pid == 0:
+                parent.close()
+                for other in self._sockets:
+                    other.close()
+                _serve_worker(child.detach(), configuration, args)
+            child.close()
+            self._sockets.append(parent)
+            self._queues.append(deque())
+            self._ready.append(Event())
+            self._alive.append(True)
+            log.info(f"Started validation worker {worker_id} (pid {pid})")
+
+    def start(self, report) -> None:
+        for i in range(len(self._sockets)):
+            gevent.spawn(self._write, i)
+            gevent.spawn(self._read, i, report)
+
+    def submit(self, channel: str, frame: Any) -> bool:
+        """:return: False when the frame was dropped"""
+        i = self._next
+        self._next = (i + 1) % len(self._queues)
+        if not self._alive[i] or len(self._queues[i]) >= self.queue_size:
+            return False
+
+        kind = REQUEST_TEXT if isinstance(frame, str) else REQUEST_BINARY
+        frame = frame.encode() if isinstance(frame, str) else bytes(frame)
+        self._queues[i].append((kind, channel.encode(), frame))
+        self._ready[i].set()
+        return True
+
+    def reload(self) -> None:
+        """Makes the workers reload the configuration files."""
+        for queue, ready in zip(self._queues, self._ready):
+            queue.append((REQUEST_RELOAD, b"", b""))
+            ready.set()
+
+    def _write(self, i: int) -> None:
+        queue = self._queues[i]
+        while True:
+            while len(queue) == 0:
+                self._ready[i].clear()
+                self._ready[i].wait()
+            kind, channel, frame = queue.popleft()
+            try:
+                self._sockets[i].sendall(REQUEST.pack(
+                    kind, len(channel), len(frame)) + channel + frame)
+            except OSError as e:
+                log.error(f"Validation worker {i} is gone: {e}")
+                self._alive[i] = False
+                queue.clear()
+                return
+
+    def _read(self, i: int, report) -> None:
+        reader = self._sockets[i].makefile("rb")
+        while True:
+            header = reader.read(RESULT.size)
+            if len(header) < RESULT.size:
+                log.error(f"Validation worker {i} has exited")
+                self._alive[i] = False
+                return
+            passed, seconds, channel_length = RESULT.unpack(header)
+            report(reader.read(channel_length).decode(), bool(passed),
+                   seconds)
+
+
+def _serve_worker(descriptor: int, configuration: Configuration,
+                  args: argparse.Namespace) -> None:
+    """Validation worker loop - blocking reads without the gevent hub,
+    so that no greenlet inherited from the server runs here."""
+    # the server process handles the signals, the worker exits
+    # when its socket is closed
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    # sockets of gevent are non-blocking
+    os.set_blocking(descriptor, True)
+    reader = os.fdopen(descriptor, "rb")
+    writer = os.fdopen(os.dup(descriptor), "wb")
+    try:
+        while True:
+            header = reader.read(REQUEST.size)
+            if len(header) < REQUEST.size:
+                break
+            kind, channel_length, frame_length = REQUEST.unpack(header)
+            channel = reader.read(channel_length)
+            frame = reader.read(frame_length)
+
+            if kind == REQUEST_RELOAD:
+                try:
+                    configuration = load_configuration(
+                        args.specification_file, args.events_file,
+                        args.cache_dir, previous=configuration)
+                except Exception:
+                    log.exception("Validation worker failed to reload "
+                                  "the configuration")
+                continue
+
+            name = channel.decode()
+            start = time.perf_counter()
+            try:
+                data = configuration.codecs[name]["publish"].decode(
+                    frame.decode() if kind == REQUEST_TEXT else frame)
+                passed = len(configuration.validators[name]["publish"](
+                    data)) > 0
+            except Exception:
+                passed = False
+            writer.write(RESULT.pack(passed, time.perf_counter() - start,
+                                     len(channel)) + channel)
+            writer.flush()
+    except Exception:
+        log.exception("Validation worker failed")
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    # Validation mode argument assertions:
+
+    assert repr(validation_mode_argument("off")[1]) == "off"
+    assert validation_mode_argument("/chat=sampled:0.25")[0] == "chat"
+    assert validation_mode_argument("/chat=sampled:0.25")[1].rate == 0.25
+    assert validation_mode_argument("full")[0] is None
+    for ex_1_v in ["sampled", "sampled:2", "chat=partial", "full:1"]:
+        try:
+            validation_mode_argument(ex_1_v)
+            assert False, ex_1_v
+        except argparse.ArgumentTypeError:
+            pass
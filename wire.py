@@ -0,0 +1,246 @@
+import json
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+
+from compiler import message_specs
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+log = logging.getLogger(__name__)
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+CBOR = "application/cbor"
+
+# content type used when neither the message nor the specification
+# (defaultContentType) specifies one
+DEFAULT_CONTENT_TYPE = JSON
+
+# WebSocket frame - text frames are str, binary frames are bytes
+Frame = Union[str, bytes, bytearray]
+
+
+class Codec:
+    """Encoding of messages of one content type into WebSocket frames."""
+    content_type = ""
+    # messages are sent as binary frames
+    binary = False
+
+    def decode(self, frame: Frame) -> Any:
+        raise NotImplementedError
+
+    def encode(self, data: Any) -> Frame:
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+    """JSON in text frames, using orjson when it is installed."""
+    content_type = JSON
+
+    def decode(self, frame: Frame) -> Any:
+        if orjson is not None:
+            return orjson.loads(frame)
+        return json.loads(frame)
+
+    def encode(self, data: Any) -> Frame:
+        if orjson is not None:
+            try:
+                return orjson.dumps(data).decode()
+            except TypeError:
+                # e.g. non-string keys or integers beyond 64 bits
+                pass
+        return json.dumps(data)
+
+
+class MsgPackCodec(Codec):
+    content_type = MSGPACK
+    binary = True
+
+    def __init__(self):
+        if msgpack is None:
+            raise NotImplementedError(f"Content type {MSGPACK} requires "
+                                      f"the msgpack package")
+
+    def decode(self, frame: Frame) -> Any:
+        return msgpack.unpackb(frame, raw=False)
+
+    def encode(self, data: Any) -> Frame:
+        return msgpack.packb(data, use_bin_type=True)
+
+
+class CborCodec(Codec):
+    content_type = CBOR
+    binary = True
+
+    def __init__(self):
+        if cbor2 is None:
+            raise NotImplementedError(f"Content type {CBOR} requires "
+                                      f"the cbor2 package")
+
+    def decode(self, frame: Frame) -> Any:
+        return cbor2.loads(frame)
+
+    def encode(self, data: Any) -> Frame:
+        return cbor2.dumps(data)
+
+
+CODECS: Dict[str, Callable[[], Codec]] = {
+    JSON: JsonCodec,
+    "text/json": JsonCodec,
+    MSGPACK: MsgPackCodec,
+    "application/x-msgpack": MsgPackCodec,
+    "application/vnd.msgpack": MsgPackCodec,
+    CBOR: CborCodec,
+}
+
+
+def get_codec(content_type: str, codecs: Dict[str, Codec] = None) -> Codec:
+    """:param codecs: already created codecs (by content type) to reuse
+    :raises NotImplementedError: for an unknown content type or a missing
+    optional package
+    """
+    # parameters (e.g. "; charset=utf-8") do not change the codec
+    media_type = content_type.split(";")[0].strip().lower()
+    if media_type.endswith("+json"):
+        media_type = JSON
+
+    if codecs is not None and media_type in codecs:
+        return codecs[media_type]
+
+    if media_type not in CODECS:
+        raise NotImplementedError(f"Content type {content_type} "
+                                  f"is not supported")
+    codec = CODECS[media_type]()
+    if codecs is not None:
+        codecs[media_type] = codec
+    return codec
+
+
+class ChannelCodec:
+    """Codecs of the messages of a channel operation (publish or subscribe).
+    Incoming frames are decoded once - by the only codec of the operation or,
+    when its messages differ, by the first codec of the frame type."""
+
+    def __init__(self, messages: Dict[str, Codec]):
+        # message name -> codec
+        self.messages = messages
+        self.codecs: List[Codec] = []
+        for codec in messages.values():
+            if codec not in self.codecs:
+                self.codecs.append(codec)
+        self._text = next((codec for codec in self.codecs
+                           if not codec.binary), None)
+        self._binary = next((codec for codec in self.codecs
+                             if codec.binary), None)
+
+    def decode(self, frame: Frame) -> Any:
+        if len(self.codecs) == 1:
+            return self.codecs[0].decode(frame)
+
+        codec = self._text if isinstance(frame, str) else self._binary
+        if codec is None:
+            raise ValueError(f"No message of the channel is sent "
+                             f"as a {type(frame).__name__} frame")
+        return codec.decode(frame)
+
+    def encoder(self, message_names: List[str]) -> Codec:
+        """:return: codec of the first of the messages
+        (of the first message of the operation if none is known)"""
+        for message_name in message_names:
+            if message_name in self.messages:
+                return self.messages[message_name]
+        return self.codecs[0]
+
+
+def compile_codecs(full_specification: Dict,
+                   codecs: Optional[Dict[str, Codec]] = None,
+                   channels: Optional[Iterable[str]] = None
+                   ) -> Dict[str, Dict[str, ChannelCodec]]:
+    """Resolves codecs of messages of all channels from their contentType
+    (or defaultContentType of the specification).
+    :param channels: names of the channels to resolve (default all)
+    :return: {channel_name: {"publish": codec, "subscribe": codec}},
+    operations without a message specification are omitted
+    """
+    if codecs is None:
+        codecs = {}
+    if channels is None:
+        channels = full_specification["channels"].keys()
+    default_content_type = full_specification.get("defaultContentType",
+                                                  DEFAULT_CONTENT_TYPE)
+
+    compiled = {}
+    for channel_name in channels:
+        channel = full_specification["channels"][channel_name]
+        compiled[channel_name] = {}
+        for operation in ("publish", "subscribe"):
+            if operation not in channel or "message" not in channel[operation]:
+                continue
+            compiled[channel_name][operation] = ChannelCodec({
+                message_spec["name"]: get_codec(
+                    message_spec.get("contentType", default_content_type),
+                    codecs)
+                for message_spec in message_specs(
+                    channel[operation]["message"], full_specification)})
+        log.debug(f"Content types of channel {channel_name}: " + str({
+            operation: [codec.content_type for codec in channel_codec.codecs]
+            for operation, channel_codec in compiled[channel_name].items()}))
+    return compiled
+
+
+if __name__ == '__main__':
+    # Codec assertions:
+
+    ex_1_d = {"text": "žluťoučký kůň", "number": 2 ** 70, "list": [1, 2.5, None]}
+    ex_1_c = get_codec("application/json; charset=utf-8")
+    assert isinstance(ex_1_c.encode(ex_1_d), str)
+    assert ex_1_c.decode(ex_1_c.encode(ex_1_d)) == ex_1_d
+    assert ex_1_c.decode(bytearray(ex_1_c.encode(ex_1_d).encode())) == ex_1_d
+    assert get_codec("application/vnd.api+json") is not None
+
+    try:
+        get_codec("application/xml")
+        assert False
+    except NotImplementedError:
+        pass
+
+    # Channel codec assertions:
+
+    ex_2_s = {
+        "defaultContentType": MSGPACK if msgpack is not None else JSON,
+        "channels": {
+            "mixed": {
+                "publish": {"message": {"oneOf": [
+                    {"$ref": "#/components/messages/text"},
+                    {"$ref": "#/components/messages/binary"},
+                ]}},
+                "subscribe": {"message": {"$ref": "#/components/messages/text"}},
+            },
+        },
+        "components": {"messages": {
+            "text": {"name": "Text", "contentType": JSON,
+                     "payload": {"type": "string"}},
+            "binary": {"name": "Binary", "payload": {"type": "string"}},
+        }},
+    }
+    ex_2_c = compile_codecs(ex_2_s)
+    assert [codec.content_type for codec
+            in ex_2_c["mixed"]["subscribe"].codecs] == [JSON]
+    assert ex_2_c["mixed"]["publish"].decode('"a"') == "a"
+    assert ex_2_c["mixed"]["publish"].encoder(["Text"]).content_type == JSON
+    if msgpack is not None:
+        assert ex_2_c["mixed"]["publish"].decode(msgpack.packb("b")) == "b"
+        assert ex_2_c["mixed"]["publish"].encoder(["Binary"]).binary
@@ -0,0 +1,108 @@
+import logging
+import os
+import shutil
+import signal
+import tempfile
+from typing import Callable, Optional
+
+import gevent
+from gevent import socket
+
+log = logging.getLogger(__name__)
+
+LISTEN_BACKLOG = 1024
+
+
+def create_listener(host: str, port: int, reuse_port: bool = True,
+                    buffer_size: Optional[int] = None) -> socket.socket:
+    """Creates a listening socket which can be shared with other processes
+    binding the same port (SO_REUSEPORT).
+    :param buffer_size: size of the kernel send and receive buffers
+    of accepted connections (inherited from the listening socket)
+    """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    if buffer_size is not None:
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, buffer_size)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, buffer_size)
+    listener.bind((host, port))
+    listener.listen(LISTEN_BACKLOG)
+    return listener
+
+
+def run_workers(workers: int, serve: Callable[[int, str], None],
+                profile: bool = False) -> int:
+    """Forks worker processes and waits for them to finish.
+    When one of the workers exits (e.g. because of --strict),
+    the remaining workers are terminated as well.
+    :param serve: called in every worker with its id and the directory
+    of the broadcast bus sockets
+    :param profile: pass SIGUSR1 (writing the profile) to the workers
+    :return: exit code of the first worker which has exited
+    """
+    if not hasattr(socket, "SO_REUSEPORT"):
+        raise NotImplementedError("Worker mode requires SO_REUSEPORT")
+
+    bus_directory = tempfile.mkdtemp(prefix="asyncapi-ws-mock-")
+    pids = {}
+
+    for worker_id in range(workers):
+        pid = gevent.fork()
+        if pid == 0:
+            # worker process
+            try:
+                serve(worker_id, bus_directory)
+            except SystemExit as e:
+                os._exit(e.code if isinstance(e.code, int) else 1)
+            except KeyboardInterrupt:
+                os._exit(0)
+            except BaseException:
+                log.exception(f"Worker {worker_id} failed")
+                os._exit(1)
+            os._exit(0)
+        pids[pid] = worker_id
+        log.info(f"Started worker {worker_id} (pid {pid})")
+
+    def terminate(*_):
+        for worker_pid in pids:
+            try:
+                os.kill(worker_pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def forward(signum, _):
+        for worker_pid in pids:
+            try:
+                os.kill(worker_pid, signum)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, terminate)
+    signal.signal(signal.SIGHUP, forward)
+    if profile:
+        signal.signal(signal.SIGUSR1, forward)
+
+    exit_code = None
+    try:
+        while len(pids) > 0:
+            try:
+                pid, status = os.waitpid(-1, 0)
+            except KeyboardInterrupt:
+                # workers receive SIGINT from the terminal as well
+                continue
+            worker_id = pids.pop(pid, None)
+            code = os.WEXITSTATUS(status) if os.WIFEXITED(status) \
+                else -os.WTERMSIG(status)
+            log.info(f"Worker {worker_id} (pid {pid}) exited with {code}")
+            if exit_code is None:
+                exit_code = code
+                terminate()
+    finally:
+        shutil.rmtree(bus_directory, ignore_errors=True)
+
+    if exit_code is None:
+        return 0
+    # a worker killed by a signal exits like a shell reports it
+    return 128 - exit_code if exit_code < 0 else exit_code